@@ -0,0 +1,82 @@
+"""
+Checks that every installed JSON codec agrees with the standard library on a
+set of Tenyks messages, then measures decode and reply encode cost for each.
+
+    python benchmarks/bench_codec.py
+
+Exits non-zero if a codec decodes a frame or encodes a reply differently
+from the standard library. The messages are the ones `tests/test_codec.py`
+checks.
+"""
+import json
+import sys
+
+from common import Benchmark, run_standalone
+from tenyksservice.codec import JSONCodec, codecs, get_codec
+from tests.test_codec import MESSAGES, META, REPLIES
+
+
+def installed_codecs():
+    for name in codecs:
+        codec = get_codec(name)
+        if codec.name == name:
+            yield codec
+
+
+def check_parity(codec, reference):
+    failures = []
+    for message in MESSAGES:
+        frame = reference.encode(message)
+        if codec.decode(frame) != reference.decode(frame):
+            failures.append('decode differs for {!r}'.format(frame))
+    envelope = codec.make_envelope(META)
+    reference_envelope = reference.make_envelope(META)
+    for message in MESSAGES:
+        for reply in REPLIES:
+            fields = (message['command'], reply, message['target'],
+                      message['connection'])
+            ours = codec.encode_message(envelope, *fields)
+            theirs = reference.encode_message(reference_envelope, *fields)
+            if json.loads(ours) != json.loads(theirs):
+                failures.append('reply differs: {!r} != {!r}'.format(ours,
+                                                                     theirs))
+    return failures
+
+
+def parity_failures():
+    """
+    Every difference between an installed codec and the standard library,
+    as 'codec: what differs' lines.
+    """
+    reference = JSONCodec()
+    return ['{}: {}'.format(codec.name, failure)
+            for codec in installed_codecs()
+            for failure in check_parity(codec, reference)]
+
+
+def benchmarks():
+    frames = [JSONCodec().encode(m) for m in MESSAGES]
+    for codec in installed_codecs():
+        envelope = codec.make_envelope(META)
+        yield Benchmark('codec.decode',
+                        lambda codec=codec: [codec.decode(f) for f in frames],
+                        ops=len(frames), codec=codec.name)
+        yield Benchmark('codec.encode_message',
+                        lambda codec=codec, envelope=envelope:
+                            codec.encode_message(envelope, 'PRIVMSG',
+                                                 REPLIES[1], '#tenyks',
+                                                 'freenode'),
+                        codec=codec.name)
+
+
+def main():
+    failures = parity_failures()
+    for failure in failures:
+        print(failure)
+    print('parity {}'.format('FAIL' if failures else 'ok'))
+    run_standalone(benchmarks())
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Measures conversation context bookkeeping: `set_expirable_context`,
+`get_context` and expiring contexts through the timer wheel, with the default
+in-memory store.
+
+    python benchmarks/bench_context.py
+"""
+from common import Benchmark, make_service, privmsg, run_standalone
+from tenyksservice.context import get_timer_wheel
+
+CONVERSATIONS = 1000
+
+
+def set_contexts(service, messages):
+    for data in messages:
+        service.set_expirable_context(data, timeout=60, step=1)
+
+
+def get_contexts(service, messages):
+    for data in messages:
+        service.get_context(data)
+
+
+def expire_contexts(service, messages):
+    """
+    Sets a context for every message, then moves the timer wheel past their
+    deadline and lets it expire them all.
+    """
+    for data in messages:
+        service.set_expirable_context(data, timeout=1)
+    wheel = get_timer_wheel(service.loop)
+    if wheel._handle is not None:
+        wheel._handle.cancel()
+    wheel._start -= 2
+    wheel._advance()
+    assert not service.conversation_context
+
+
+def benchmarks():
+    messages = [privmsg('!start', nick='nick{}'.format(i))
+                for i in range(CONVERSATIONS)]
+
+    service = make_service()
+    yield Benchmark('context.set',
+                    lambda: set_contexts(service, messages),
+                    ops=len(messages), conversations=CONVERSATIONS)
+
+    service = make_service()
+    set_contexts(service, messages)
+    yield Benchmark('context.get',
+                    lambda: get_contexts(service, messages),
+                    ops=len(messages), conversations=CONVERSATIONS)
+
+    service = make_service()
+    yield Benchmark('context.set_and_expire',
+                    lambda: expire_contexts(service, messages),
+                    ops=len(messages), conversations=CONVERSATIONS)
+
+
+if __name__ == '__main__':
+    run_standalone(benchmarks())
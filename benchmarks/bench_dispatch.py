@@ -0,0 +1,64 @@
+"""
+Measures what a service does with a message once it has been decoded:
+`data_is_valid`, `_delegate` through the registered command handlers, and the
+same through the dispatcher's per-conversation queues.
+
+    python benchmarks/bench_dispatch.py
+"""
+import asyncio
+
+from common import (Benchmark, PAYLOADS, make_service, privmsg,
+                    run_coroutine, run_standalone)
+from tenyksservice.context import conversation_key
+
+FILTER_COUNTS = (10, 100)
+PING = {'command': 'PING', 'payload': '', 'target': '', 'connection': ''}
+INVALID = {'command': 'PRIVMSG', 'target': '#tenyks'}
+
+
+def validate(service, messages):
+    for data in messages:
+        service.data_is_valid(data)
+
+
+def delegate_every_message(service, messages):
+    async def delegate():
+        for data in messages:
+            # a copy, _respond_to_ping rewrites a PING into its PONG
+            await service._delegate(dict(data))
+    return run_coroutine(service.loop, delegate)
+
+
+def dispatch_every_message(service, messages):
+    async def dispatch():
+        for data in messages:
+            service.dispatcher.submit(conversation_key(data), dict(data))
+        while service.dispatcher.conversations:
+            await asyncio.sleep(0)
+    return run_coroutine(service.loop, dispatch)
+
+
+def benchmarks():
+    messages = [privmsg(payload) for payload in PAYLOADS]
+    checked = messages + [PING, INVALID]
+    service = make_service()
+    yield Benchmark('dispatch.data_is_valid',
+                    lambda: validate(service, checked), ops=len(checked))
+    yield Benchmark('dispatch.delegate_ping',
+                    delegate_every_message(service, [PING]))
+    for count in FILTER_COUNTS:
+        service = make_service(count)
+        yield Benchmark('dispatch.delegate_privmsg',
+                        delegate_every_message(service, messages),
+                        ops=len(messages), filters=count)
+
+    service = make_service()
+    conversations = [privmsg(payload, nick='nick{}'.format(i))
+                     for i in range(50) for payload in PAYLOADS[:2]]
+    yield Benchmark('dispatch.dispatcher_submit',
+                    dispatch_every_message(service, conversations),
+                    ops=len(conversations), conversations=50)
+
+
+if __name__ == '__main__':
+    run_standalone(benchmarks())
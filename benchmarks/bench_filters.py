@@ -0,0 +1,51 @@
+"""
+Measures PRIVMSG filter matching with 10, 100 and 1000 filter chains: every
+chain's `FilterChain.attempt_match` in turn (what matching cost before the
+filter index), and `TenyksService.search_for_match` with and without
+`combine_filters`.
+
+    python benchmarks/bench_filters.py
+"""
+from common import (Benchmark, PAYLOADS, make_service, privmsg,
+                    run_coroutine, run_standalone)
+
+FILTER_COUNTS = (10, 100, 1000)
+
+
+def attempt_every_chain(chains, payloads):
+    for payload in payloads:
+        for chain in chains:
+            if chain.attempt_match(payload):
+                break
+
+
+def search_every_payload(service, messages):
+    async def search():
+        for data in messages:
+            await service.search_for_match(data)
+    return run_coroutine(service.loop, search)
+
+
+def benchmarks():
+    messages = [privmsg(payload) for payload in PAYLOADS]
+    for count in FILTER_COUNTS:
+        service = make_service(count)
+        chains = list(service.irc_message_filters.values())
+        yield Benchmark(
+            'filters.attempt_match',
+            lambda chains=chains: attempt_every_chain(chains, PAYLOADS),
+            ops=len(PAYLOADS), filters=count)
+        yield Benchmark(
+            'filters.search_for_match',
+            search_every_payload(service, messages),
+            ops=len(messages), filters=count)
+
+        combined = make_service(count, combine_filters=True)
+        yield Benchmark(
+            'filters.search_for_match_combined',
+            search_every_payload(combined, messages),
+            ops=len(messages), filters=count)
+
+
+if __name__ == '__main__':
+    run_standalone(benchmarks())
@@ -0,0 +1,74 @@
+"""
+Measures what it costs to encode one reply in `TenyksService.send` with each
+installed codec, next to the old approach of building the whole dict and
+running `json.dumps` on it, and what a whole `send` costs on top of that.
+
+    python benchmarks/bench_send.py
+"""
+import json
+
+from common import Benchmark, make_service, run_standalone
+from tenyksservice.codec import codecs
+
+DATA = {
+    'command': 'PRIVMSG',
+    'payload': "hi, I'm kyle",
+    'target': '#tenyks',
+    'connection': 'freenode',
+    'nick': 'kyle',
+    'direct': True,
+    'from_channel': True,
+}
+MESSAGE = 'How are you kyle?!'
+
+
+def encode_with_dumps(service, message, data):
+    return json.dumps({
+        'command': data['command'],
+        'payload': message,
+        'target': data['target'],
+        'connection': data['connection'],
+        'meta': {
+            'name': service.name,
+            'version': service.version or 0.0,
+            'UUID': service.settings.SERVICE_UUID,
+            'description': service.settings.SERVICE_DESCRIPTION
+        }
+    }).encode('utf-8')
+
+
+def benchmarks():
+    baseline = make_service(JSON_CODEC='json')
+    expected = encode_with_dumps(baseline, MESSAGE, DATA)
+    assert baseline._encode_reply(MESSAGE, DATA) == expected
+
+    yield Benchmark('send.json_dumps',
+                    lambda: encode_with_dumps(baseline, MESSAGE, DATA))
+    for name in codecs:
+        service = make_service(JSON_CODEC=name)
+        if service.codec.name != name:
+            continue  # not installed
+        assert (json.loads(service._encode_reply(MESSAGE, DATA)) ==
+                json.loads(expected))
+        yield Benchmark('send.encode',
+                        lambda service=service: service._encode_reply(MESSAGE,
+                                                                      DATA),
+                        codec=name)
+        yield Benchmark('send.send',
+                        send_many(service), ops=100, codec=name)
+
+
+def send_many(service):
+    """
+    `send` only queues the frame, so let the outbound writer empty the queue
+    after every hundred replies.
+    """
+    def call():
+        for _ in range(100):
+            service.send(MESSAGE, DATA)
+        service.loop.run_until_complete(service.outbound.flush())
+    return call
+
+
+if __name__ == '__main__':
+    run_standalone(benchmarks())
@@ -0,0 +1,137 @@
+"""
+Measures how long a service takes to start: from launching the process to
+the REGISTER frame arriving at a bound SUB socket standing in for tenyks, and
+how long `import tenyksservice` takes in a fresh interpreter.
+
+    python benchmarks/bench_startup.py
+
+Every run starts a new `examples/hello-service` process, so these are much
+slower than the other benchmarks and `usec_per_op` is one whole start up.
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import zmq
+
+from common import ROOT, run_standalone
+
+HELLO_SERVICE = os.path.join(ROOT, 'examples', 'hello-service', 'main.py')
+SETTINGS = """
+DEBUG = False
+SERVICE_NAME = 'hello'
+SERVICE_VERSION = '0.1.1'
+SERVICE_UUID = '273b62ad-a99d-48be-8d80-ccc55ef688b4'
+SERVICE_DESCRIPTION = 'Hello service will let you greet Tenyks'
+WORKING_DIRECTORY_PATH = {working_dir!r}
+ZMQ_CONNECTION = {{'in': {in_addr!r}, 'out': {out_addr!r}}}
+"""
+# seconds a service gets to send REGISTER before the run counts as failed
+register_timeout = 30
+
+
+class StartupBenchmark(object):
+    """
+    Like `common.Benchmark` but times `func()` once per run, as it returns
+    its own measurement in seconds.
+    """
+
+    def __init__(self, name, func, **params):
+        self.name = name
+        self.func = func
+        self.params = params
+
+    @property
+    def label(self):
+        return self.name
+
+    def run(self, repeat=5, min_time=None):
+        # the first start warms up the page cache and bytecode
+        self.func()
+        times = [self.func() for _ in range(repeat)]
+        return {
+            'name': self.name,
+            'params': self.params,
+            'usec_per_op': min(times) * 1e6,
+            'mean_usec_per_op': sum(times) / len(times) * 1e6,
+            'ops_per_sec': 1 / min(times),
+            'number': 1,
+            'repeat': repeat,
+        }
+
+
+def _environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def time_to_register():
+    working_dir = tempfile.mkdtemp(prefix='tenyks-bench-')
+    context = zmq.Context.instance()
+    # the service connects its SUB to 'in' and its PUB to 'out'
+    pub = context.socket(zmq.PUB)
+    pub.bind('tcp://127.0.0.1:*')
+    sub = context.socket(zmq.SUB)
+    sub.setsockopt(zmq.SUBSCRIBE, b'')
+    sub.bind('tcp://127.0.0.1:*')
+    settings_path = os.path.join(working_dir, 'settings.py')
+    with open(settings_path, 'w') as f:
+        f.write(SETTINGS.format(
+            working_dir=working_dir,
+            in_addr=pub.getsockopt_string(zmq.LAST_ENDPOINT),
+            out_addr=sub.getsockopt_string(zmq.LAST_ENDPOINT)))
+    poller = zmq.Poller()
+    poller.register(sub, zmq.POLLIN)
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, HELLO_SERVICE, settings_path], env=_environment(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + register_timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or process.poll() is not None:
+                raise RuntimeError('the service did not send REGISTER')
+            if poller.poll(min(remaining, 0.1) * 1000):
+                if b'REGISTER' in sub.recv():
+                    return time.perf_counter() - start
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        pub.close(linger=0)
+        sub.close(linger=0)
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def time_to_import():
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'import tenyksservice'],
+                          env=_environment())
+    return time.perf_counter() - start
+
+
+def time_interpreter():
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'pass'], env=_environment())
+    return time.perf_counter() - start
+
+
+def benchmarks():
+    yield StartupBenchmark('startup_interpreter', time_interpreter)
+    yield StartupBenchmark('startup_import', time_to_import)
+    yield StartupBenchmark('startup_register', time_to_register)
+
+
+if __name__ == '__main__':
+    run_standalone(benchmarks())
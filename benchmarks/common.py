@@ -0,0 +1,195 @@
+"""
+Shared helpers for the benchmarks: timing, fixtures and a service that can be
+driven without sockets.
+
+Every `bench_*.py` module has a `benchmarks()` function yielding `Benchmark`s.
+`run.py` collects them all; each module can also be run on its own.
+"""
+import asyncio
+import os
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tenyksservice import TenyksService, FilterChain  # noqa: E402
+
+
+class BenchSettings(object):
+    SERVICE_UUID = '273b62ad-a99d-48be-8d80-ccc55ef688b4'
+    SERVICE_DESCRIPTION = 'Hello service will let you greet Tenyks'
+
+
+def privmsg(payload, nick='kyle', target='#tenyks', direct=False,
+            from_channel=True):
+    """
+    A PRIVMSG shaped like the ones Tenyks publishes.
+    """
+    return {
+        'command': 'PRIVMSG',
+        'payload': payload,
+        'target': target,
+        'connection': 'freenode',
+        'nick': nick,
+        'host': 'unaffiliated/{}'.format(nick),
+        'full_message': ':{0}!~{0}@unaffiliated/{0} PRIVMSG {1} :{2}'.format(
+            nick, target, payload),
+        'user': '~{}'.format(nick),
+        'from_channel': from_channel,
+        'direct': direct,
+    }
+
+
+PAYLOADS = [
+    "hi, I'm kyle",
+    '!weather seattle',
+    'did anyone see the game last night?',
+    '!cmd7 some arguments here',
+    'lol',
+    'https://example.com/some/link?with=query',
+    '!help 273b62ad-a99d-48be-8d80-ccc55ef688b4',
+    '!nothing matches this',
+]
+
+
+def make_filters(count):
+    """
+    `count` filter chains that look like real services: mostly `!command`
+    triggers, a greeting and a couple of patterns without a fixed prefix.
+    """
+    filters = {
+        'hello': FilterChain([r"^(hi|hello|sup|hey), I'm (?P<name>(.*))$"]),
+        'weather': FilterChain([r'^!weather\s+(?P<location>.*)$']),
+        'link': FilterChain([r'.*(?P<url>https?://\S+)']),
+    }
+    i = 0
+    while len(filters) < count:
+        if i % 25 == 24:
+            filters['loose{}'.format(i)] = FilterChain(
+                [r'.*\bword{}\b.*'.format(i)])
+        else:
+            filters['cmd{}'.format(i)] = FilterChain(
+                [r'^!cmd{}\s+(?P<args>.*)$'.format(i),
+                 r'^!cmd{}$'.format(i)])
+        i += 1
+    return dict(list(filters.items())[:count])
+
+
+class NullStream(object):
+    """
+    Stands in for the PUB stream. Frames written to it are dropped.
+    """
+
+    def write(self, frames):
+        pass
+
+    async def drain(self):
+        pass
+
+
+def make_service(filter_count=10, combine_filters=False, **settings):
+    """
+    A service with `filter_count` filter chains whose handlers do nothing,
+    wired up the way `run` does it but without any sockets. Replies go through
+    the outbound queue into a `NullStream`.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    filters = make_filters(filter_count)
+    attrs = {
+        'irc_message_filters': filters,
+        'combine_filters': combine_filters,
+        'handle': lambda self, data, match, name: None,
+    }
+    for name in filters:
+        attrs['handle_{}'.format(name)] = lambda self, data, match: None
+    service_class = type('BenchService', (TenyksService,), attrs)
+
+    bench_settings = BenchSettings()
+    for key, value in settings.items():
+        setattr(bench_settings, key, value)
+    service = service_class('bench', bench_settings)
+    service.outbound.start(NullStream())
+    service.add_command_handler('PING', service._respond_to_ping)
+    service.add_command_handler('PRIVMSG', service._help_check)
+    service.add_command_handler('PRIVMSG', service._privmsg_handler)
+    _services.append(service)
+    return service
+
+
+_services = []
+
+
+def close_services():
+    """
+    Stops the outbound writers of every service `make_service` built.
+    """
+    while _services:
+        service = _services.pop()
+        service.outbound.close()
+        service.loop.run_until_complete(asyncio.sleep(0))
+        service.loop.close()
+
+
+class Benchmark(object):
+    """
+    One thing to time. `func` is called with no arguments and does `ops`
+    operations per call.
+    """
+
+    def __init__(self, name, func, ops=1, **params):
+        self.name = name
+        self.func = func
+        self.ops = ops
+        self.params = params
+
+    @property
+    def label(self):
+        if not self.params:
+            return self.name
+        return '{}[{}]'.format(self.name, ','.join(
+            '{}={}'.format(k, v) for k, v in sorted(self.params.items())))
+
+    def run(self, repeat=5, min_time=0.2):
+        timer = timeit.Timer(self.func)
+        number, _ = timer.autorange()
+        while True:
+            start = time.perf_counter()
+            timer.timeit(number)
+            if time.perf_counter() - start >= min_time:
+                break
+            number *= 2
+        times = timer.repeat(repeat=repeat, number=number)
+        ops = number * self.ops
+        return {
+            'name': self.name,
+            'params': self.params,
+            'usec_per_op': min(times) / ops * 1e6,
+            'mean_usec_per_op': sum(times) / len(times) / ops * 1e6,
+            'ops_per_sec': ops / min(times),
+            'number': number,
+            'repeat': repeat,
+        }
+
+
+def run_coroutine(loop, coroutine_function, *args):
+    """
+    Returns a callable that runs `coroutine_function(*args)` to completion.
+    """
+    def call():
+        return loop.run_until_complete(coroutine_function(*args))
+    return call
+
+
+def print_result(label, result):
+    print('{:<50} {:10.3f} usec/op {:14,.0f} ops/sec'.format(
+        label, result['usec_per_op'], result['ops_per_sec']))
+
+
+def run_standalone(benchmarks):
+    for benchmark in benchmarks:
+        print_result(benchmark.label, benchmark.run())
+    close_services()
@@ -0,0 +1,81 @@
+"""
+Runs every benchmark in this directory and prints one line per result.
+
+    python benchmarks/run.py [-k filters] [--json results.json]
+
+`-k` only runs benchmarks whose name contains the given text. `--json` also
+writes the results, with the Python and tenyksservice versions they were taken
+with, so runs from different releases can be compared. Exits non-zero if a
+JSON codec fails the parity check in `bench_codec.py`.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import sys
+
+import common
+import bench_codec
+import bench_context
+import bench_dispatch
+import bench_filters
+import bench_send
+import bench_startup
+
+modules = [bench_filters, bench_dispatch, bench_send, bench_codec,
+           bench_context, bench_startup]
+
+
+def package_version():
+    """
+    The version in setup.py, so results from a checkout are labelled with
+    the release they were taken on.
+    """
+    with open(os.path.join(common.ROOT, 'setup.py')) as f:
+        match = re.search(r"version\s*=\s*['\"]([^'\"]+)", f.read())
+    return match.group(1) if match else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tenyks service benchmarks')
+    parser.add_argument('-k', dest='keyword', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--json', dest='json_path',
+                        help='write the results to this file')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    failures = bench_codec.parity_failures()
+    for failure in failures:
+        print(failure)
+
+    results = []
+    for module in modules:
+        for benchmark in module.benchmarks():
+            if args.keyword not in benchmark.name:
+                continue
+            result = benchmark.run(repeat=args.repeat)
+            common.print_result(benchmark.label, result)
+            results.append(result)
+    common.close_services()
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'implementation': platform.python_implementation(),
+                    'platform': platform.platform(),
+                    'tenyksservice': package_version(),
+                    'time': datetime.datetime.utcnow().isoformat() + 'Z',
+                    'codec_parity': not failures,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -34,7 +34,9 @@ setup(name='tenyksservice',
       ],
       entry_points={
           'console_scripts': [
-              'tenyks-service-mkconfig = tenyksservice.config:make_config'
+              'tenyks-service-mkconfig = tenyksservice.config:make_config',
+              'tenyks-service-hub = tenyksservice.hub:main',
+              'tenyks-service-replay = tenyksservice.recording:main',
           ]
       },
       )
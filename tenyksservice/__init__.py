@@ -1,4 +1,8 @@
 from .service import TenyksService, run_service, FilterChain
+from .executors import offload, THREAD, PROCESS
+from .cache import memoize
+from .scheduler import every, cron
 
 
-__all__ = ['TenyksService', 'run_service', 'FilterChain']
+__all__ = ['TenyksService', 'run_service', 'FilterChain', 'offload', 'THREAD',
+           'PROCESS', 'memoize', 'every', 'cron']
@@ -0,0 +1,198 @@
+import collections
+import contextvars
+import functools
+import inspect
+import time
+
+from .singleflight import SingleFlight
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'negative_hits', 'maxsize', 'currsize'])
+
+# replies sent while a memoized call is running, so a cache hit can send them
+# again
+_captured_sends = contextvars.ContextVar('tenyks_captured_sends', default=None)
+
+
+def capture_send(service, message, data):
+    """
+    Called by `TenyksService.send` for every reply.
+    """
+    captured = _captured_sends.get()
+    if captured is not None:
+        captured.append((service, message, data))
+
+
+def _find_data(args):
+    for arg in args:
+        if isinstance(arg, dict):
+            return arg
+    return None
+
+
+def _find_match(args):
+    for arg in args:
+        if hasattr(arg, 'groupdict'):
+            return arg
+    return None
+
+
+def memoize(ttl=60, maxsize=128, groups=None, negative_ttl=None, key=None):
+    """
+    Caches what a handle method or helper returns and the replies it sends.
+
+        @memoize(ttl=600, groups=['location'])
+        async def handle_weather(self, data, match):
+            report = await fetch_weather(match.group('location'))
+            self.send(report, data)
+
+    With `groups`, calls are keyed on those fields of the match's
+    `groupdict()`, so `!weather seattle` from anyone is answered from the
+    cache for `ttl` seconds. Replies the first call sent to the message it
+    was handling are sent again, to the new message, on a hit. A handle
+    method memoized without `groups` is keyed on the message's payload.
+    Other calls are keyed on their arguments (other than `self`), which have
+    to be hashable, and `key` can be given to build the key from the
+    arguments instead.
+
+    At most `maxsize` results are kept, least recently used first out. A call
+    that returns None and sends nothing is only cached if `negative_ttl` is
+    set, for that many seconds. Exceptions are never cached.
+
+    Coroutines are also coalesced: calls that miss while the same key is
+    already being worked out wait for that call (see `SingleFlight`) and get
+    its result and replies, or its exception. If every call waiting on it is
+    cancelled, say by `HANDLER_TIMEOUT`, the work is cancelled as well.
+
+    The wrapped function gets `cache_info()` and `cache_clear()`. The cache is
+    shared by every instance of the service class.
+    """
+    def decorator(func):
+        entries = collections.OrderedDict()
+        stats = {'hits': 0, 'misses': 0, 'negative_hits': 0}
+        flight = SingleFlight()
+        is_method = 'self' in inspect.signature(func).parameters
+
+        def make_key(args, kwargs):
+            call_args = args[1:] if is_method else args
+            if key is not None:
+                return key(*call_args, **kwargs)
+            if groups is not None:
+                match = _find_match(call_args)
+                found = match.groupdict() if match is not None else {}
+                return tuple(found.get(g) for g in groups)
+            if (not kwargs and len(call_args) == 2 and
+                    isinstance(call_args[0], dict) and
+                    hasattr(call_args[1], 'groupdict')):
+                # a handle method, (data, match)
+                return (call_args[0].get('payload'),)
+            cache_key = call_args + tuple(sorted(kwargs.items()))
+            try:
+                hash(cache_key)
+            except TypeError:
+                raise TypeError(
+                    '{} was called with unhashable arguments, give memoize '
+                    'groups= or key= to say what to cache on'.format(
+                        func.__name__))
+            return cache_key
+
+        def lookup(cache_key):
+            entry = entries.get(cache_key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del entries[cache_key]
+                return None
+            entries.move_to_end(cache_key)
+            stats['hits'] += 1
+            if entry[1] is None and not entry[2]:
+                stats['negative_hits'] += 1
+            return entry
+
+        def replay(entry, args):
+            _, result, sends, call_data = entry
+            data = _find_data(args)
+            for service, message, sent_to in sends:
+                if sent_to is call_data and data is not None:
+                    sent_to = data
+                service.send(message, sent_to)
+            return result
+
+        def store(cache_key, result, sends, args):
+            entry = (None, result, sends, _find_data(args))
+            if result is None and not sends:
+                if negative_ttl is None:
+                    return entry
+                expires = time.monotonic() + negative_ttl
+            else:
+                expires = time.monotonic() + ttl
+            entry = (expires,) + entry[1:]
+            entries[cache_key] = entry
+            entries.move_to_end(cache_key)
+            while maxsize and len(entries) > maxsize:
+                entries.popitem(last=False)
+            return entry
+
+        if inspect.iscoroutinefunction(func):
+            async def compute(caller, cache_key, args, kwargs):
+                sends = []
+                token = _captured_sends.set(sends)
+                try:
+                    result = await func(*args, **kwargs)
+                finally:
+                    _captured_sends.reset(token)
+                    _forward(sends)
+                return caller, store(cache_key, result, sends, args)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                cache_key = make_key(args, kwargs)
+                entry = lookup(cache_key)
+                if entry is not None:
+                    return replay(entry, args)
+                stats['misses'] += 1
+                caller = object()
+                worker, entry = await flight.do(cache_key, compute, caller,
+                                                cache_key, args, kwargs)
+                if worker is not caller:
+                    # another call did the work, send its replies to us
+                    return replay(entry, args)
+                return entry[1]
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                cache_key = make_key(args, kwargs)
+                entry = lookup(cache_key)
+                if entry is not None:
+                    return replay(entry, args)
+                stats['misses'] += 1
+                sends = []
+                token = _captured_sends.set(sends)
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    _captured_sends.reset(token)
+                    _forward(sends)
+                store(cache_key, result, sends, args)
+                return result
+
+        def cache_info():
+            return CacheInfo(stats['hits'], stats['misses'],
+                             stats['negative_hits'], maxsize, len(entries))
+
+        def cache_clear():
+            entries.clear()
+            for name in stats:
+                stats[name] = 0
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+def _forward(sends):
+    # a memoized call inside another one: the outer call replays these too
+    outer = _captured_sends.get()
+    if outer is not None:
+        outer.extend(sends)
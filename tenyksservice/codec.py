@@ -0,0 +1,104 @@
+import json
+from json.encoder import encode_basestring_ascii
+
+default_codec = 'auto'
+
+
+class JSONCodec(object):
+    """
+    The standard library codec. Always available.
+
+    Every codec reads and writes bytes directly so there is no intermediate
+    str on either side of the socket. Replies are encoded with
+    `encode_message`, which only encodes the per-message fields and appends
+    an envelope made once by `make_envelope`. The standard library codec
+    gives exactly the bytes `json.dumps` gives for the full dict.
+    """
+
+    name = 'json'
+
+    def decode(self, frame):
+        return json.loads(frame)
+
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def make_envelope(self, meta):
+        return ', "meta": {}}}'.format(json.dumps(meta))
+
+    def encode_message(self, envelope, command, payload, target, connection):
+        try:
+            fields = (encode_basestring_ascii(command),
+                      encode_basestring_ascii(payload),
+                      encode_basestring_ascii(target),
+                      encode_basestring_ascii(connection))
+        except TypeError:
+            # something other than a str, let json work it out
+            fields = tuple(json.dumps(v)
+                           for v in (command, payload, target, connection))
+        return ('{"command": %s, "payload": %s, "target": %s, '
+                '"connection": %s%s' % (fields + (envelope,))).encode('utf-8')
+
+
+class _BytesCodec(object):
+    # shared by the codecs whose encoder returns bytes
+
+    def make_envelope(self, meta):
+        return b', "meta": ' + self.encode(meta) + b'}'
+
+    def encode_message(self, envelope, command, payload, target, connection):
+        encode = self.encode
+        return b''.join((
+            b'{"command": ', encode(command),
+            b', "payload": ', encode(payload),
+            b', "target": ', encode(target),
+            b', "connection": ', encode(connection),
+            envelope))
+
+
+class OrjsonCodec(_BytesCodec):
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.decode = orjson.loads
+        self.encode = orjson.dumps
+
+
+class MsgspecCodec(_BytesCodec):
+
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+        self.decode = msgspec.json.decode
+        self.encode = msgspec.json.encode
+
+
+codecs = {
+    JSONCodec.name: JSONCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgspecCodec.name: MsgspecCodec,
+}
+
+
+def get_codec(name=default_codec):
+    """
+    Returns the codec called `name`. `auto` picks the fastest one that is
+    installed. If the codec asked for isn't installed, this falls back to the
+    standard library.
+    """
+    if name == 'auto':
+        candidates = [OrjsonCodec, MsgspecCodec]
+    elif name in codecs:
+        candidates = [codecs[name]]
+    else:
+        raise ValueError('JSON_CODEC must be one of {}'.format(
+            ('auto',) + tuple(codecs)))
+    for codec_class in candidates:
+        try:
+            return codec_class()
+        except ImportError:
+            continue
+    return JSONCodec()
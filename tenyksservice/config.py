@@ -1,16 +1,10 @@
 import os
 import errno
 from os.path import abspath, join, dirname
-import uuid
 import sys
-import logging.config
 import logging
-from logging.handlers import SysLogHandler
-
-from jinja2 import Template
 
 from .module_loader import make_module_from_file
-from .packages.termcolor import colored
 
 
 SERVICE_ROOT = abspath(dirname(__file__))
@@ -74,7 +68,14 @@ settings = Settings()
 
 class ColorFormatter(logging.Formatter):
 
+    def __init__(self, *args, **kwargs):
+        super(ColorFormatter, self).__init__(*args, **kwargs)
+        # only services that log to the console need termcolor
+        from .packages.termcolor import colored
+        self._colored = colored
+
     def format(self, record):
+        colored = self._colored
         if record.levelname in COLORS:
             color = COLORS[record.levelname]
             record.msg = colored(record.msg, color)
@@ -172,6 +173,7 @@ Use `tenyks-service-mkconfig servicename > /path/to/settings.py`
                 'formatter': 'color'
             }
         elif settings.LOG_TO == 'syslog':
+            from logging.handlers import SysLogHandler
             LOGGING_CONFIG['handlers']['syslog'] = {
                 'address': settings.SYSLOG_PATH,
                 'level': settings.LOG_LEVEL,
@@ -190,12 +192,18 @@ Use `tenyks-service-mkconfig servicename > /path/to/settings.py`
 
     setattr(settings, 'LOGGING_CONFIG', LOGGING_CONFIG)
 
+    import logging.config
     logging.config.dictConfig(LOGGING_CONFIG)
 
     return errors
 
 
 def make_config():
+    # imported here so services don't pay for jinja2 at startup
+    import uuid
+
+    from jinja2 import Template
+
     usage = 'tenyks-service-mkconfig servicename'
     if len(sys.argv) < 2:
         print(usage)
@@ -1,18 +1,120 @@
 import asyncio
+import collections
+import math
+import os
+import sys
+import time
+import weakref
 
 default_expirable_context_timeout = 10
+default_timer_resolution = 0.5
+default_context_max_entries = 10000
+
+
+class TimerWheel:
+    """
+    One timer for every context that can expire.
+
+    Deadlines are rounded up to the next tick of `resolution` seconds and kept
+    in a hashed wheel of `slots` buckets, each mapping a tick to the entries
+    due on it. Scheduling and rescheduling an entry are O(1), and each tick
+    only looks at the entries that are due on it. The wheel only keeps a
+    callback on the loop while it has entries.
+
+    Entries are objects with a `_wheel_tick` attribute (None when they are not
+    scheduled) and an `_expire` method that is called when they are due.
+    """
+
+    def __init__(self, loop, resolution=default_timer_resolution, slots=512):
+        self.resolution = resolution
+
+        self._loop = loop
+        self._slots = [{} for _ in range(slots)]
+        self._start = loop.time()
+        self._tick = 0
+        self._handle = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _now_tick(self):
+        return int((self._loop.time() - self._start) / self.resolution)
+
+    def schedule(self, entry, delay):
+        if self._handle is None:
+            # nothing is due, so skip the ticks we slept through
+            self._tick = self._now_tick()
+        if entry._wheel_tick is None:
+            self._count += 1
+        else:
+            self._discard(entry)
+        deadline = self._loop.time() - self._start + delay
+        tick = max(self._tick + 1,
+                   int(math.ceil(deadline / self.resolution)))
+        entry._wheel_tick = tick
+        self._slots[tick % len(self._slots)].setdefault(tick, set()).add(entry)
+        if self._handle is None:
+            self._handle = self._loop.call_later(self.resolution, self._advance)
+
+    def cancel(self, entry):
+        if entry._wheel_tick is not None:
+            self._discard(entry)
+            entry._wheel_tick = None
+            self._count -= 1
+
+    def _discard(self, entry):
+        slot = self._slots[entry._wheel_tick % len(self._slots)]
+        due = slot.get(entry._wheel_tick)
+        if due is not None:
+            due.discard(entry)
+            if not due:
+                del slot[entry._wheel_tick]
+
+    def _advance(self):
+        self._handle = None
+        now = self._now_tick()
+        while self._tick < now:
+            self._tick += 1
+            due = self._slots[self._tick % len(self._slots)].pop(self._tick,
+                                                                 None)
+            if not due:
+                continue
+            for entry in due:
+                entry._wheel_tick = None
+                self._count -= 1
+            for entry in due:
+                entry._expire()
+        if self._count and self._handle is None:
+            self._handle = self._loop.call_later(self.resolution, self._advance)
+
+
+_timer_wheels = weakref.WeakKeyDictionary()
+
+
+def get_timer_wheel(loop):
+    """
+    Returns the timer wheel shared by every context on `loop`.
+    """
+    wheel = _timer_wheels.get(loop)
+    if wheel is None:
+        wheel = _timer_wheels[loop] = TimerWheel(loop)
+    return wheel
 
 
 class ExpirableContext:
-    def __init__(self, msg, loop=None, timeout=10, logger=None):
+    def __init__(self, msg, loop=None, timeout=10, logger=None, timer=None):
         self.msg = msg
 
         self._expired = False
         self._logger = logger
         self._kv = {}
         self._timeout = timeout
-        self._loop = loop
-        self._task = self._loop.create_task(self.set_expired_after(self._timeout))
+        self._loop = loop or asyncio.get_event_loop()
+        self._timer = timer or get_timer_wheel(self._loop)
+        self._wheel_tick = None
+        self._expire_callbacks = []
+        self._timer.schedule(self, self._timeout)
 
     def __getitem__(self, key):
         return self._kv[key]
@@ -23,18 +125,207 @@ class ExpirableContext:
     def __delitem__(self, key):
         del self._kv[key]
 
-    async def set_expired_after(self, timeout):
-        await asyncio.sleep(timeout)
+    def add_expire_callback(self, callback):
+        """
+        Calls `callback(context)` when the context expires.
+        """
+        self._expire_callbacks.append(callback)
 
+    def _expire(self):
         if self._logger:
             self._logger.debug('context expired')
 
         self._expired = True
+        for callback in self._expire_callbacks:
+            callback(self)
 
     def reset(self):
-        self._task.cancel()
-        self._task = self._loop.create_task(self.set_expired_after(self._timeout))
+        self._timer.schedule(self, self._timeout)
+
+    def cancel(self):
+        """
+        Stops the expiry timer, used when the context is thrown away early.
+        """
+        self._timer.cancel(self)
 
     @property
     def is_expired(self):
         return self._expired
+
+
+def approximate_size(ctx):
+    """
+    A rough byte count for a context: the object itself plus one level of
+    whatever it stores.
+    """
+    size = sys.getsizeof(ctx)
+    for contents in (getattr(ctx, '_kv', None), getattr(ctx, 'msg', None),
+                     ctx):
+        if isinstance(contents, dict):
+            size += sys.getsizeof(contents)
+            for k, v in contents.items():
+                size += sys.getsizeof(k) + sys.getsizeof(v)
+    return size
+
+
+def conversation_key(data):
+    """
+    The `connection:target:nick` key of the conversation a message belongs
+    to. Contexts are stored under it, the dispatcher keeps its messages in
+    order by it and worker mode shards on it. Missing fields count as empty,
+    since not every command has a nick.
+    """
+    return '{}:{}:{}'.format(data.get('connection', ''),
+                             data.get('target', ''),
+                             data.get('nick', ''))
+
+
+class ContextStore:
+    """
+    Conversation contexts keyed by `connection:target:nick`.
+
+    The store holds at most `max_entries` contexts and, if `max_bytes` is
+    set, roughly that many bytes of them (measured when a context is stored).
+    When either limit is hit the least recently used contexts are evicted. If
+    `ttl` is set, contexts that haven't been stored or looked up for that many
+    seconds are evicted too.
+
+    Eviction callbacks are called as `callback(key, ctx, reason)` where reason
+    is 'size' or 'ttl'. Removing a context with `pop` or `del` is not an
+    eviction.
+    """
+
+    def __init__(self, max_entries=default_context_max_entries, max_bytes=None,
+                 ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()
+        self._eviction_callbacks = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __getitem__(self, key):
+        ctx = self.get(key, self)
+        if ctx is self:
+            raise KeyError(key)
+        return ctx
+
+    def __setitem__(self, key, ctx):
+        self._remove(key)
+        size = approximate_size(ctx)
+        self._entries[key] = (ctx, size, time.monotonic())
+        self.bytes += size
+        self._evict_idle()
+        while len(self._entries) > 1 and (
+                (self.max_entries and len(self._entries) > self.max_entries) or
+                (self.max_bytes and self.bytes > self.max_bytes)):
+            self._evict(next(iter(self._entries)), 'size')
+
+    def __delitem__(self, key):
+        if self._remove(key) is None:
+            raise KeyError(key)
+
+    def add_eviction_callback(self, callback):
+        self._eviction_callbacks.append(callback)
+
+    def expirable_context(self, msg, timeout, loop=None, logger=None):
+        return ExpirableContext(msg, loop=loop, timeout=timeout, logger=logger)
+
+    def get(self, key, default=None):
+        self._evict_idle()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries[key] = entry[:2] + (time.monotonic(),)
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def peek(self, key, default=None):
+        """
+        Like `get` but doesn't count as a use.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def pop(self, key, default=None):
+        entry = self._remove(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        return entry
+
+    def _evict(self, key, reason):
+        ctx = self._remove(key)[0]
+        self.evictions += 1
+        for callback in self._eviction_callbacks:
+            callback(key, ctx, reason)
+
+    def _evict_idle(self):
+        if not self.ttl:
+            return
+        oldest = time.monotonic() - self.ttl
+        while self._entries:
+            key, (_, _, used) = next(iter(self._entries.items()))
+            if used > oldest:
+                break
+            self._evict(key, 'ttl')
+
+
+def make_context_store(settings):
+    """
+    Returns the context store picked by `CONTEXT_BACKEND`: 'memory' (the
+    default) keeps contexts in this process, 'sqlite' shares them with every
+    process using the same database.
+    """
+    backend = getattr(settings, 'CONTEXT_BACKEND', 'memory')
+    max_entries = getattr(settings, 'CONTEXT_MAX_ENTRIES',
+                          default_context_max_entries)
+    if backend == 'memory':
+        return ContextStore(
+            max_entries=max_entries,
+            max_bytes=getattr(settings, 'CONTEXT_MAX_BYTES', None),
+            ttl=getattr(settings, 'CONTEXT_TTL', None))
+    if backend == 'sqlite':
+        from .sqlite_context import SqliteContextStore, \
+            default_context_cache_ttl
+        path = getattr(settings, 'CONTEXT_DATABASE', None)
+        if path is None:
+            directory = getattr(settings, 'DATA_WORKING_DIR', None)
+            path = os.path.join(directory or os.getcwd(), 'contexts.sqlite3')
+        return SqliteContextStore(
+            path,
+            cache_ttl=getattr(settings, 'CONTEXT_CACHE_TTL',
+                              default_context_cache_ttl),
+            max_entries=max_entries)
+    raise ValueError("CONTEXT_BACKEND must be one of ('memory', 'sqlite')")
@@ -0,0 +1,68 @@
+import asyncio
+import collections
+
+default_dispatch_concurrency = 10
+
+
+class Dispatcher:
+    """
+    Runs a message handler for many conversations at once.
+
+    Messages are queued per key. Each key is drained by its own task so
+    messages from the same conversation are handled in the order they
+    arrived, while different conversations are handled in parallel. No more
+    than `concurrency` messages are handled at the same time.
+    """
+
+    def __init__(self, handler, concurrency=default_dispatch_concurrency,
+                 loop=None, logger=None, on_error=None):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.on_error = on_error
+        self.queue_depth = 0
+        self.in_flight = 0
+
+        self._loop = loop
+        self._logger = logger
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues = {}
+        self._workers = {}
+
+    def submit(self, key, message):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+            self._workers[key] = self._loop.create_task(
+                self._drain(key, queue))
+        queue.append(message)
+        self.queue_depth += 1
+
+    async def _drain(self, key, queue):
+        try:
+            while queue:
+                message = queue.popleft()
+                async with self._semaphore:
+                    self.queue_depth -= 1
+                    self.in_flight += 1
+                    try:
+                        await self.handler(message)
+                    except Exception:
+                        if self._logger:
+                            self._logger.exception(
+                                'error handling message for %s', key)
+                        if self.on_error:
+                            self.on_error()
+                    finally:
+                        self.in_flight -= 1
+        finally:
+            self.queue_depth -= len(queue)
+            self._queues.pop(key, None)
+            self._workers.pop(key, None)
+
+    @property
+    def conversations(self):
+        return len(self._queues)
+
+    def close(self):
+        for task in list(self._workers.values()):
+            task.cancel()
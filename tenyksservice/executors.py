@@ -0,0 +1,152 @@
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import re
+
+THREAD = 'thread'
+PROCESS = 'process'
+
+match_type = type(re.match('', ''))
+
+
+def offload(kind=THREAD):
+    """
+    Marks a `handle_<name>` or `handle` method as blocking so the service runs
+    it in a pool instead of on the event loop.
+
+        @offload()
+        def handle_lookup(self, data, match):
+            row = slow_database_call(match.groupdict()['key'])
+            self.send(row, data)
+
+    Thread handlers are ordinary methods and can call `self.send` like any
+    other handler. Process handlers run in another interpreter so they can't
+    touch the service. They have to be static methods, they get a picklable
+    copy of the match (see `MatchResult`) and whatever they return, a string
+    or a list of strings, is sent as the reply.
+
+        @staticmethod
+        @offload(PROCESS)
+        def handle_crunch(data, match):
+            return crunch(match.group('numbers'))
+    """
+    if callable(kind):
+        # used as a bare @offload
+        kind._executor = THREAD
+        return kind
+    if kind not in (THREAD, PROCESS):
+        raise ValueError('kind must be one of {}'.format((THREAD, PROCESS)))
+
+    def decorator(func):
+        func._executor = kind
+        return func
+    return decorator
+
+
+class CallTimeout(asyncio.TimeoutError):
+    """
+    Raised by `call_with_timeout` when the call runs out of time. `state` is
+    'cancelled', or 'abandoned' for offloaded calls that keep running.
+    """
+
+    def __init__(self, state):
+        super(CallTimeout, self).__init__(state)
+        self.state = state
+
+
+async def call_with_timeout(func, args, timeout, loop, get_executor,
+                            name=None, logger=None):
+    """
+    Calls `func(*args)` the way handle methods and scheduled jobs are called
+    and returns what it returns. Coroutines are awaited and functions marked
+    with `offload` run in `get_executor(kind)` so they don't block the loop.
+    Process pool functions get a `MatchResult` for every match argument.
+
+    Either way the call is given `timeout` seconds. A coroutine is cancelled
+    then, but a thread or process can't be stopped: an offloaded call keeps
+    running and whatever it returns is ignored. The timeout is logged as
+    `name` and `CallTimeout` is raised.
+    """
+    name = name or func.__name__
+    kind = getattr(func, '_executor', None)
+    if kind is None:
+        result = func(*args)
+        if not inspect.isawaitable(result):
+            return result
+    else:
+        if kind == PROCESS:
+            if inspect.ismethod(func):
+                raise TypeError('{} runs in a process pool and has to be a '
+                                'static method'.format(name))
+            args = tuple(MatchResult(a) if isinstance(a, match_type) else a
+                         for a in args)
+        result = loop.run_in_executor(get_executor(kind),
+                                      functools.partial(func, *args))
+
+    try:
+        return await asyncio.wait_for(result, timeout)
+    except asyncio.TimeoutError:
+        if kind is None:
+            state = 'cancelled'
+            if logger:
+                logger.error('{} did not finish within {} seconds and was '
+                             'cancelled'.format(name, timeout))
+        else:
+            state = 'abandoned'
+            if logger:
+                logger.error('{} timed out after {} seconds and is still '
+                             'running in the {} pool, its result will be '
+                             'ignored'.format(name, timeout, kind))
+        raise CallTimeout(state)
+
+
+def make_executor(kind, max_workers=None):
+    if kind == PROCESS:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+
+class MatchResult(object):
+    """
+    A picklable stand-in for a regular expression match, handed to handlers
+    that run in a process pool.
+    """
+
+    def __init__(self, match):
+        self.string = match.string
+        self._groups = (match.group(0),) + match.groups()
+        self._spans = tuple(match.span(i) for i in range(len(self._groups)))
+        self._groupindex = dict(match.re.groupindex)
+
+    def _index(self, group):
+        if isinstance(group, int):
+            return group
+        return self._groupindex[group]
+
+    def group(self, *groups):
+        if not groups:
+            return self._groups[0]
+        if len(groups) == 1:
+            return self._groups[self._index(groups[0])]
+        return tuple(self._groups[self._index(g)] for g in groups)
+
+    def __getitem__(self, group):
+        return self.group(group)
+
+    def groups(self, default=None):
+        return tuple(default if g is None else g for g in self._groups[1:])
+
+    def groupdict(self, default=None):
+        return dict((name, self._groups[index] if self._groups[index]
+                     is not None else default)
+                    for name, index in self._groupindex.items())
+
+    def span(self, group=0):
+        return self._spans[self._index(group)]
+
+    def start(self, group=0):
+        return self.span(group)[0]
+
+    def end(self, group=0):
+        return self.span(group)[1]
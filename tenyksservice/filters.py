@@ -1,25 +1,221 @@
+import itertools
 import re
+import time
+import warnings
 
-from .packages import six
+# Prefix tokens are read off the pattern as parsed by the re module's own
+# parser. It is private and has changed between Python versions, so if it is
+# missing or gives us something unexpected the chain isn't indexed and is
+# tried for every payload, which is slower but still correct.
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None
+
+
+_token_re = re.compile(r'\W*\w*')
+_word_re = re.compile(r'\w')
+_max_prefixes = 64
+
+
+def first_token(message):
+    """
+    Returns the leading token of a message: any run of non-word characters
+    followed by a run of word characters. `!weather seattle` gives `!weather`
+    and `hi, I'm kyle` gives `hi`.
+    """
+    return _token_re.match(message).group()
+
+
+def _literal_alternatives(op, av):
+    # returns every character a single parsed regex item can match if it only
+    # ever matches literals, otherwise None
+    if op is sre_parse.LITERAL:
+        return [chr(av)]
+    if op is sre_parse.IN:
+        if all(o is sre_parse.LITERAL for o, _ in av):
+            return [chr(c) for _, c in av]
+    return None
+
+
+def _ends_token(item):
+    # True if this item can only match where a token ends
+    if item is None:
+        return False
+    op, av = item
+    if op is sre_parse.AT:
+        return av in (sre_parse.AT_BOUNDARY, sre_parse.AT_END,
+                      sre_parse.AT_END_STRING)
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        low, _, sub = av
+        sub = list(sub)
+        return low >= 1 and len(sub) == 1 and _ends_token(sub[0])
+    if op is sre_parse.IN:
+        return all(o is sre_parse.CATEGORY and
+                   c in (sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_WORD)
+                   for o, c in av)
+    return False
+
+
+def _sequence_tokens(items, literals=('',)):
+    literals = list(literals)
+    following = None
+    for index, (op, av) in enumerate(items):
+        if (op is sre_parse.AT and literals == [''] and
+                av in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING,
+                       sre_parse.AT_BOUNDARY)):
+            continue
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            # groups don't change what matches, look inside them
+            return _sequence_tokens(list(av[-1]) + items[index + 1:], literals)
+        if op is sre_parse.BRANCH:
+            tokens = set()
+            for sequence in av[1]:
+                branch_tokens = _sequence_tokens(
+                    list(sequence) + items[index + 1:], literals)
+                if branch_tokens is None:
+                    return None
+                tokens |= branch_tokens
+            if len(tokens) > _max_prefixes:
+                return None
+            return tokens
+        alternatives = _literal_alternatives(op, av)
+        if alternatives is None:
+            following = items[index]
+            break
+        literals = [l + a for l in literals for a in alternatives]
+        if len(literals) > _max_prefixes:
+            return None
+    tokens = set()
+    for literal in literals:
+        token = first_token(literal)
+        if not _word_re.search(token):
+            return None
+        if len(token) == len(literal) and not _ends_token(following):
+            return None
+        tokens.add(token)
+    return tokens
+
+
+def literal_prefix_tokens(pattern):
+    """
+    Returns the set of first tokens a payload must start with for `pattern`
+    to match it, or None if that can't be worked out from the pattern.
+    """
+    if not isinstance(pattern, str) or sre_parse is None:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern)
+        if parsed.state.flags & (re.IGNORECASE | re.ASCII | re.LOCALE):
+            return None
+        return _sequence_tokens(list(parsed))
+    except Exception:
+        # re.error, a pattern nested too deep or a parser we don't know
+        return None
+
+
+class PatternStats(object):
+    """
+    How long one pattern of a filter chain has spent matching.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+    def as_dict(self):
+        return {
+            'pattern': getattr(self.pattern, 'pattern', self.pattern),
+            'calls': self.calls,
+            'total': self.total,
+            'max': self.max,
+            'slow': self.slow,
+        }
 
 
 class FilterChain(object):
 
-    def __init__(self, filters, direct_only=False, private_only=False):
+    def __init__(self, filters, direct_only=False, private_only=False,
+                 timeout=None):
         if direct_only and private_only:
             warnings.warn('private_only implies direct_only')
         self.filters = filters
         self.direct_only = direct_only
         self.private_only = private_only
+        # seconds the handle method may run for. None uses HANDLER_TIMEOUT.
+        self.timeout = timeout
         self.compiled_filters = []
+        self.prefix_tokens = None
+        # one PatternStats per pattern while profiling is on
+        self.pattern_stats = None
+        self._profile = None
 
     def _compile_filters(self):
+        # the chains live on the service class, so this can be called once
+        # per service instance. start from scratch each time.
+        self.compiled_filters = []
+        self.prefix_tokens = set()
+        if self._profile is not None:
+            self.pattern_stats = []
         if self.filters:
             for f in self.filters:
-                if isinstance(f, six.string_types):
-                    self.compiled_filters.append(re.compile(f).match)
+                if isinstance(f, str):
+                    match_func = re.compile(f).match
+                else:
+                    match_func = f  # already compiled filters
+                if self._profile is not None:
+                    stats = PatternStats(f)
+                    self.pattern_stats.append(stats)
+                    match_func = self._timed(match_func, stats)
+                self.compiled_filters.append(match_func)
+                tokens = literal_prefix_tokens(f)
+                if tokens is None or self.prefix_tokens is None:
+                    self.prefix_tokens = None
                 else:
-                    self.compiled_filters.append(f)  # already compiled filters
+                    self.prefix_tokens |= tokens
+
+    def enable_profiling(self, name, threshold=None, logger=None):
+        """
+        Times every pattern in the chain. Totals and maximums end up in
+        `pattern_stats`, and a match that takes `threshold` seconds or longer
+        is logged as a warning with the payload that caused it.
+        """
+        self._profile = (name, threshold, logger)
+        self._compile_filters()
+
+    def _timed(self, match_func, stats):
+        name, threshold, logger = self._profile
+
+        def timed_match(message):
+            start = time.perf_counter()
+            try:
+                return match_func(message)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats.calls += 1
+                stats.total += elapsed
+                if elapsed > stats.max:
+                    stats.max = elapsed
+                if threshold is not None and elapsed >= threshold:
+                    stats.slow += 1
+                    if logger is not None:
+                        logger.warning(
+                            'filter %s pattern %r took %.3fs to match %r',
+                            name, stats.as_dict()['pattern'], elapsed, message)
+        return timed_match
+
+    def is_eligible(self, data):
+        if self.direct_only and not data.get('direct', False):
+            return False
+        if self.private_only and data.get('from_channel', True):
+            return False
+        return True
 
     def attempt_match(self, message):
         # tried to match message and returns the first one found or None
@@ -32,3 +228,137 @@ class FilterChain(object):
 
 class RegexpFilterChain(FilterChain):
     pass
+
+
+class FilterIndex(object):
+    """
+    Maps the first token of a payload to the filter chains that could
+    possibly match it.
+
+    Chains whose patterns all start with known literal tokens are only tried
+    when the payload starts with one of those tokens. Chains we can't work out
+    a prefix for are tried for every payload. Candidates keep the order of
+    `irc_message_filters`.
+    """
+
+    def __init__(self, filter_chains):
+        order = dict((name, i) for i, name in enumerate(filter_chains))
+        indexed = {}
+        unindexed = []
+        for name, filter_chain in filter_chains.items():
+            if filter_chain.prefix_tokens is None:
+                unindexed.append(name)
+                continue
+            for token in filter_chain.prefix_tokens:
+                indexed.setdefault(token, []).append(name)
+        self._fallback = tuple(unindexed)
+        self._candidates = dict(
+            (token, tuple(sorted(set(names + unindexed), key=order.get)))
+            for token, names in indexed.items())
+
+    @property
+    def tokens(self):
+        """
+        The first tokens that can match an indexed chain, or None if some
+        chain could match any payload.
+        """
+        if self._fallback:
+            return None
+        return frozenset(self._candidates)
+
+    def candidates(self, message):
+        return self._candidates.get(first_token(message), self._fallback)
+
+
+_named_group_re = re.compile(r'(?<!\\)\(\?P<(\w+)>')
+_named_backref_re = re.compile(r'(?<!\\)\(\?P=(\w+)\)')
+_uncombinable_re = re.compile(r'(?<!\\)(\\\\)*\\[1-9]|\(\?\(|^\(\?[aiLmsux]+\)')
+
+
+class CombinedFilterMatcher(object):
+    """
+    Matches a message against many filter chains with as few regex scans as
+    possible.
+
+    Every string pattern is wrapped in a named group and joined into one big
+    alternation, in the same order `search_for_match` would have tried them.
+    The alternation tells us which pattern matched first and that single
+    pattern is then run again so handlers get the exact match object they
+    would have gotten before. Patterns that cannot safely live inside an
+    alternation (numbered backreferences, conditionals, global inline flags
+    and pre-compiled callables) are kept as their own step, so ordering and
+    first-match-wins are unchanged.
+
+    Combined engines are built per set of eligible chains and cached, because
+    `direct_only` and `private_only` change which chains a message may hit.
+    """
+
+    def __init__(self, filter_chains):
+        self.filter_chains = filter_chains
+        self._engines = {}
+
+    def attempt_match(self, names, message):
+        """
+        Returns `(name, match)` for the first chain in `names` that matches
+        `message`, or `(None, None)`.
+        """
+        engine = self._engines.get(names)
+        if engine is None:
+            engine = self._engines[names] = self._build_engine(names)
+        for combined, lookup in engine:
+            if combined is None:
+                name, match_func = lookup
+                match = match_func(message)
+                if match:
+                    return name, match
+                continue
+            found = combined(message)
+            if found:
+                name, match_func = lookup[found.lastgroup]
+                return name, match_func(message)
+        return None, None
+
+    def _build_engine(self, names):
+        engine = []
+        pending = []
+        counter = itertools.count()
+
+        def flush():
+            if not pending:
+                return
+            combined = re.compile('|'.join(p for p, _, _ in pending)).match
+            lookup = dict((group, (name, match_func))
+                          for _, group, (name, match_func) in pending)
+            engine.append((combined, lookup))
+            del pending[:]
+
+        for name in names:
+            chain = self.filter_chains[name]
+            for pattern, match_func in zip(chain.filters,
+                                           chain.compiled_filters):
+                group = '_tf{}'.format(next(counter))
+                wrapped = self._wrap(pattern, group)
+                if wrapped is None:
+                    flush()
+                    engine.append((None, (name, match_func)))
+                else:
+                    pending.append((wrapped, group, (name, match_func)))
+        flush()
+        return engine
+
+    def _wrap(self, pattern, group):
+        if not isinstance(pattern, str):
+            return None
+        if _uncombinable_re.search(pattern):
+            return None
+        prefix = group + '_'
+        pattern = _named_group_re.sub(
+            lambda m: '(?P<{}{}>'.format(prefix, m.group(1)), pattern)
+        pattern = _named_backref_re.sub(
+            lambda m: '(?P={}{})'.format(prefix, m.group(1)), pattern)
+        wrapped = '(?P<{}>{})'.format(group, pattern)
+        try:
+            re.compile(wrapped)
+        except re.error:
+            return None
+        return wrapped
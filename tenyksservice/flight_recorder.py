@@ -0,0 +1,62 @@
+import collections
+import json
+import os
+import time
+
+IN = 'in'
+OUT = 'out'
+
+
+class FlightRecorder:
+    """
+    Keeps the last `size` raw frames the service received and sent.
+
+    Recording a frame only appends a reference to it to a bounded deque, so
+    it is cheap enough to leave on in production. Nothing is decoded or
+    formatted until `dump` writes the frames to a JSON lines file in
+    `directory`.
+    """
+
+    # error dumps closer together than this are skipped
+    error_dump_interval = 60
+
+    def __init__(self, size, directory, name='service', logger=None):
+        self.directory = directory
+        self.name = name
+
+        self._logger = logger
+        self._frames = collections.deque(maxlen=size)
+        self._last_error_dump = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def record(self, direction, frame):
+        self._frames.append((time.time(), direction, frame))
+
+    def dump(self, reason='requested'):
+        """
+        Writes the recorded frames to disk and returns the file path.
+        """
+        path = os.path.join(self.directory, '{}-flight-{}.jsonl'.format(
+            self.name, time.strftime('%Y%m%d-%H%M%S')))
+        with open(path, 'a') as f:
+            for timestamp, direction, frame in list(self._frames):
+                f.write(json.dumps({
+                    'time': timestamp,
+                    'direction': direction,
+                    'frame': frame.decode('utf-8', 'replace'),
+                }))
+                f.write('\n')
+        if self._logger:
+            self._logger.warning('dumped {} frames to {} ({})'.format(
+                len(self._frames), path, reason))
+        return path
+
+    def dump_on_error(self):
+        now = time.monotonic()
+        if (self._last_error_dump is not None and
+                now - self._last_error_dump < self.error_dump_interval):
+            return None
+        self._last_error_dump = now
+        return self.dump('error')
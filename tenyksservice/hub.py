@@ -0,0 +1,349 @@
+"""
+A stand-in for the Tenyks bot, for load testing a service without one.
+
+    tenyks-service-hub [settings.py] [--rate 200] [--duration 10]
+
+binds the sockets `ZMQ_CONNECTION` points at, waits for the service to
+register and then sends it PRIVMSGs at the given rate, printing throughput and
+request-to-reply latency when it is done.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import sys
+
+import aiozmq
+import zmq
+
+from .codec import get_codec
+
+default_zmq_connection = {
+    'out': 'tcp://localhost:61124',
+    'in': 'tcp://localhost:61123'
+}
+default_payloads = ["hi, I'm loadgen"]
+
+
+def privmsg(payload, nick='loadgen', target='#loadgen', connection='loadgen',
+            direct=True, from_channel=True):
+    """
+    A PRIVMSG shaped like the ones Tenyks publishes.
+    """
+    return {
+        'command': 'PRIVMSG',
+        'payload': payload,
+        'target': target,
+        'connection': connection,
+        'nick': nick,
+        'host': 'fake/{}'.format(nick),
+        'full_message': ':{0}!~{0}@fake/{0} PRIVMSG {1} :{2}'.format(
+            nick, target, payload),
+        'user': '~{}'.format(nick),
+        'from_channel': from_channel,
+        'direct': direct,
+    }
+
+
+def load_payloads(path):
+    """
+    Reads the payloads of the inbound PRIVMSGs in a flight recorder dump.
+    """
+    payloads = []
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('direction') != 'in':
+                continue
+            try:
+                data = json.loads(entry['frame'])
+            except ValueError:
+                continue
+            if data.get('command') == 'PRIVMSG' and 'payload' in data:
+                payloads.append(data['payload'])
+    return payloads
+
+
+def percentile(values, p):
+    """
+    The nearest-rank `p`th percentile of sorted `values`.
+    """
+    if not values:
+        return None
+    rank = max(1, int(round(p / 100.0 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+class FakeHub:
+    """
+    Binds the PUB socket services read from (`ZMQ_CONNECTION['in']`) and the
+    SUB socket they write to (`ZMQ_CONNECTION['out']`), so a service can be
+    pointed at it in place of Tenyks.
+
+    Services that REGISTER are kept in `services` by UUID. `hello` and `ping`
+    send the commands Tenyks would. Every other frame a service sends is
+    passed to the reply callbacks as `callback(data, received_at)`, with
+    `received_at` in loop time.
+    """
+
+    def __init__(self, zmq_connection=None, loop=None, logger=None):
+        self.zmq_connection = zmq_connection or default_zmq_connection
+        self.services = {}
+        self.frames_in = 0
+        self.frames_out = 0
+        self.pongs = 0
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._logger = logger or logging.getLogger('tenyks-hub')
+        self._codec = get_codec()
+        self._reply_callbacks = []
+        self._registered = asyncio.Event()
+        self._read_task = None
+        self._ping_task = None
+
+    async def start(self):
+        self._pub = await aiozmq.create_zmq_stream(zmq.PUB, loop=self._loop)
+        # don't drop frames when a replay outruns the service
+        self._pub.transport.setsockopt(zmq.SNDHWM, 0)
+        await self._pub.transport.bind(self.zmq_connection['in'])
+        self._sub = await aiozmq.create_zmq_stream(
+            zmq.SUB, bind=self.zmq_connection['out'], loop=self._loop)
+        self._sub.transport.setsockopt(zmq.SUBSCRIBE, b'')
+        self._read_task = self._loop.create_task(self._read())
+        self._logger.info('hub listening on {} and {}'.format(
+            self.zmq_connection['in'], self.zmq_connection['out']))
+
+    def close(self):
+        for task in (self._read_task, self._ping_task):
+            if task is not None:
+                task.cancel()
+        self._pub.close()
+        self._sub.close()
+
+    def add_reply_callback(self, callback):
+        self._reply_callbacks.append(callback)
+
+    def send(self, data):
+        self.send_frame(self._codec.encode(data))
+
+    def send_frame(self, frame):
+        self._pub.write([frame])
+        self.frames_out += 1
+
+    def hello(self):
+        self.send({'command': 'HELLO', 'payload': '', 'target': '',
+                   'connection': ''})
+
+    def ping(self):
+        self.send({'command': 'PING', 'payload': '', 'target': '',
+                   'connection': ''})
+
+    def start_pinging(self, interval=30):
+        async def ping_forever():
+            while True:
+                self.ping()
+                await asyncio.sleep(interval)
+        self._ping_task = self._loop.create_task(ping_forever())
+
+    async def wait_for_service(self, timeout=None, hello_interval=1):
+        """
+        Sends HELLO every `hello_interval` seconds until a service registers.
+        Returns False if none did within `timeout` seconds.
+        """
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while not self._registered.is_set():
+            self.hello()
+            wait = hello_interval
+            if deadline is not None:
+                wait = min(wait, deadline - self._loop.time())
+                if wait <= 0:
+                    return False
+            try:
+                await asyncio.wait_for(self._registered.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    async def _read(self):
+        while True:
+            frames = await self._sub.read()
+            received_at = self._loop.time()
+            self.frames_in += 1
+            try:
+                data = self._codec.decode(frames[0])
+            except ValueError:
+                self._logger.error('bad frame from service: %r', frames[0])
+                continue
+            command = data.get('command')
+            if command == 'REGISTER':
+                self._register(data)
+            elif command == 'BYE':
+                meta = data.get('meta', {})
+                self.services.pop(meta.get('UUID'), None)
+                self._logger.info('{} said bye'.format(meta.get('name')))
+            else:
+                if command == 'PONG' and not data.get('target'):
+                    self.pongs += 1
+                for callback in self._reply_callbacks:
+                    callback(data, received_at)
+
+    def _register(self, data):
+        meta = data.get('meta', {})
+        self.services[meta.get('UUID')] = meta
+        self._logger.info('{} {} registered'.format(meta.get('name'),
+                                                    meta.get('version')))
+        self._registered.set()
+
+
+class LoadGenerator:
+    """
+    Sends PRIVMSGs through a `FakeHub` at `rate` per second and times how
+    long each one takes to be answered.
+
+    Every request goes to its own target so the first frame a service sends
+    back to that target is its reply. Only replies a handler `send`s count:
+    services don't say when a handler is done, so a payload nothing matches,
+    or whose handler sends nothing, is never answered. Requests without a
+    reply within `settle` seconds of the last send are counted as
+    unanswered, which is only a failure for payloads the service replies to.
+    """
+
+    def __init__(self, hub, payloads=None, rate=100, count=None, duration=10,
+                 settle=2):
+        self.hub = hub
+        self.payloads = payloads or default_payloads
+        self.rate = rate
+        self.count = count if count is not None else int(rate * duration)
+        self.settle = settle
+
+        self._sent_at = {}
+        self._latencies = []
+        self._last_reply = None
+        hub.add_reply_callback(self._reply)
+
+    def _reply(self, data, received_at):
+        sent_at = self._sent_at.pop(data.get('target'), None)
+        if sent_at is not None:
+            self._latencies.append(received_at - sent_at)
+            self._last_reply = received_at
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        payloads = itertools.cycle(self.payloads)
+        start = loop.time()
+        for i in range(self.count):
+            due = start + i / float(self.rate)
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            target = '#load{}'.format(i)
+            self._sent_at[target] = loop.time()
+            self.hub.send(privmsg(next(payloads), target=target))
+        sent_done = loop.time()
+        deadline = sent_done + self.settle
+        while self._sent_at and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.report(start, sent_done)
+
+    def report(self, start, sent_done):
+        latencies = sorted(self._latencies)
+        end = self._last_reply or sent_done
+        elapsed = max(end - start, 1e-9)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            'sent': self.count,
+            'answered': len(latencies),
+            'unanswered': len(self._sent_at),
+            'target_rate': self.rate,
+            'send_rate': round(self.count / max(sent_done - start, 1e-9), 1),
+            'throughput': round(len(latencies) / elapsed, 1),
+            'latency_ms': {
+                'p50': ms(percentile(latencies, 50)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1] if latencies else None),
+            },
+        }
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    print('sent {sent} at {send_rate}/s (target {target_rate}/s), '
+          'answered {answered}, unanswered {unanswered}'.format(**report))
+    print('throughput {}/s'.format(report['throughput']))
+    print('latency p50 {} ms  p99 {} ms  max {} ms'.format(
+        latency['p50'], latency['p99'], latency['max']))
+
+
+async def run_load(args, zmq_connection, payloads):
+    hub = FakeHub(zmq_connection)
+    await hub.start()
+    try:
+        if not await hub.wait_for_service(timeout=args.wait):
+            print('no service registered within {} seconds'.format(args.wait))
+            return None
+        hub.start_pinging(args.ping_interval)
+        generator = LoadGenerator(hub, payloads, rate=args.rate,
+                                  count=args.count, duration=args.duration,
+                                  settle=args.settle)
+        return await generator.run()
+    finally:
+        hub.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Stand in for Tenyks and load test a service.')
+    parser.add_argument('settings', nargs='?',
+                        help="service settings file to take ZMQ_CONNECTION "
+                             "from")
+    parser.add_argument('--rate', type=float, default=100,
+                        help='PRIVMSGs per second (default 100)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to send for (default 10)')
+    parser.add_argument('--count', type=int,
+                        help='send this many PRIVMSGs instead')
+    parser.add_argument('--payload', action='append', dest='payloads',
+                        help='payload to send, can be repeated')
+    parser.add_argument('--dump',
+                        help='send the PRIVMSG payloads from a flight '
+                             'recorder dump')
+    parser.add_argument('--wait', type=float, default=30,
+                        help='seconds to wait for the service to register')
+    parser.add_argument('--settle', type=float, default=2,
+                        help='seconds to wait for replies after the last send')
+    parser.add_argument('--ping-interval', type=float, default=30)
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s:%(levelname)s '
+                               '%(message)s')
+    zmq_connection = default_zmq_connection
+    if args.settings:
+        from .module_loader import make_module_from_file
+        zmq_connection = make_module_from_file(
+            'settings', args.settings).ZMQ_CONNECTION
+    payloads = args.payloads
+    if args.dump:
+        payloads = load_payloads(args.dump)
+        if not payloads:
+            print('no PRIVMSGs in {}'.format(args.dump))
+            sys.exit(1)
+
+    loop = asyncio.get_event_loop()
+    try:
+        report = loop.run_until_complete(run_load(args, zmq_connection,
+                                                  payloads))
+    except KeyboardInterrupt:
+        sys.exit(1)
+    if report is None:
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print_report(report)
@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import signal
+
+from .executors import MatchResult
+from .filters import FilterChain, CombinedFilterMatcher
+
+# seconds a freshly started match process gets to import the service and
+# compile its patterns
+match_process_start_timeout = 5
+
+
+def _match_worker(conn, patterns, combine):
+    # the service decides when this process goes away
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    chains = collections.OrderedDict()
+    for name, filters in patterns:
+        chains[name] = FilterChain(filters)
+        chains[name]._compile_filters()
+    matcher = CombinedFilterMatcher(chains) if combine else None
+    conn.send('ready')
+    while True:
+        try:
+            names, payload = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if matcher is not None:
+            name, match = matcher.attempt_match(names, payload)
+        else:
+            name, match = None, None
+            for name in names:
+                match = chains[name].attempt_match(payload)
+                if match:
+                    break
+        conn.send((name, MatchResult(match)) if match else None)
+
+
+class IsolatedMatcher(object):
+    """
+    Matches PRIVMSGs against filter chains in a separate process, so a
+    pattern that backtracks for seconds can't block the event loop.
+
+    Every message gets `budget` seconds to be matched against all of its
+    candidate chains. If the process doesn't answer in time it is killed and
+    restarted, the message counts as a non-match and `timeouts` goes up. A
+    match comes back as a `MatchResult`, with the groups and spans the
+    process found, so no pattern ever runs on the event loop.
+
+    There is one match process and one pipe, so matching is serialized: with
+    `DISPATCH_CONCURRENCY` above 1, conversations still take turns here, and
+    a message that uses up its budget holds up the ones behind it.
+
+    Chains with pre-compiled filters can't be sent to another process and
+    are matched in this process, in their usual order, without a budget. If
+    the match process can't be started at all, every chain is.
+
+    The match process is started with `spawn`, which imports the service's
+    main script again. Without an `if __name__ == '__main__':` guard around
+    `run_service` that import starts a second copy of the service instead,
+    and matching goes without a budget once `match_process_start_timeout`
+    runs out.
+    """
+
+    def __init__(self, filter_chains, budget, combine=False, logger=None,
+                 loop=None):
+        self.filter_chains = filter_chains
+        self.budget = budget
+        self.combine = combine
+        self.timeouts = 0
+        self.restarts = 0
+
+        self._logger = logger
+        self._loop = loop or asyncio.get_event_loop()
+        self._isolated = set(
+            name for name, chain in filter_chains.items()
+            if all(isinstance(f, str) for f in chain.filters))
+        self._process = None
+        self._conn = None
+        self._ready = None
+        self._broken = False
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        """
+        Starts the match process without waiting for it to be ready.
+        """
+        import multiprocessing
+
+        patterns = [(name, list(chain.filters))
+                    for name, chain in self.filter_chains.items()
+                    if name in self._isolated]
+        self._conn, child_conn = multiprocessing.Pipe()
+        spawn = multiprocessing.get_context('spawn')
+        self._process = spawn.Process(
+            target=_match_worker, args=(child_conn, patterns, self.combine),
+            daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._ready = False
+
+    def close(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
+            self._process = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def attempt_match(self, names, message):
+        """
+        Returns `(name, match)` for the first chain in `names` that matches
+        `message`, or `(None, None)`.
+        """
+        batch = []
+        for name in names:
+            if name in self._isolated:
+                batch.append(name)
+                continue
+            if batch:
+                found = await self._isolated_match(tuple(batch), message)
+                if found is not None:
+                    return found
+                batch = []
+            match = self.filter_chains[name].attempt_match(message)
+            if match:
+                return name, match
+        if batch:
+            found = await self._isolated_match(tuple(batch), message)
+            if found is not None:
+                return found
+        return None, None
+
+    async def wait_ready(self):
+        """
+        Starts the match process if needed and waits until it can take
+        messages. Returns False if it couldn't be started.
+        """
+        async with self._lock:
+            return await self._wait_ready()
+
+    async def _wait_ready(self):
+        if self._broken:
+            return False
+        if self._process is None:
+            self.start()
+        if not self._ready:
+            try:
+                await self._recv(match_process_start_timeout)
+            except (asyncio.TimeoutError, EOFError, OSError):
+                if self._logger:
+                    self._logger.error(
+                        'filter match process did not start within {}s, '
+                        'matching without a budget. Does the main script '
+                        'call run_service under if __name__ == '
+                        '\'__main__\'?'.format(match_process_start_timeout))
+                self.close()
+                self._broken = True
+                return False
+            self._ready = True
+        return True
+
+    async def _isolated_match(self, names, message):
+        async with self._lock:
+            if not await self._wait_ready():
+                return self._local_match(names, message)
+            self._conn.send((names, message))
+            try:
+                found = await self._recv(self.budget)
+            except (asyncio.TimeoutError, EOFError, OSError):
+                self.timeouts += 1
+                if self._logger:
+                    self._logger.warning(
+                        'filters did not finish matching %r within %ss, '
+                        'treating it as no match', message, self.budget)
+                self._restart()
+                return None
+        return found
+
+    def _local_match(self, names, message):
+        for name in names:
+            match = self.filter_chains[name].attempt_match(message)
+            if match:
+                return name, match
+        return None
+
+    def _restart(self):
+        self.close()
+        self.restarts += 1
+        self.start()
+
+    async def _recv(self, timeout):
+        readable = self._loop.create_future()
+        fd = self._conn.fileno()
+
+        def on_readable():
+            if not readable.done():
+                readable.set_result(None)
+
+        self._loop.add_reader(fd, on_readable)
+        try:
+            await asyncio.wait_for(readable, timeout)
+        finally:
+            self._loop.remove_reader(fd)
+        return self._conn.recv()
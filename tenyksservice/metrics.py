@@ -0,0 +1,231 @@
+"""
+Counters, gauges and histograms a service keeps about itself.
+
+`Registry.snapshot()` returns the current values as plain Python data and
+`Registry.prometheus_text()` renders them in the Prometheus text format.
+`MetricsServer` serves that text over HTTP on a TCP port or a unix socket.
+"""
+import asyncio
+import bisect
+import math
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=(), func=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._func = func
+        self._values = {}
+
+    def _key(self, labels):
+        if len(self.labelnames) == 1:
+            return labels[0]
+        return labels
+
+    def snapshot(self):
+        if self._func is not None:
+            return self._func()
+        if not self.labelnames:
+            return self._values.get((), 0)
+        return dict((self._key(labels), value)
+                    for labels, value in self._values.items())
+
+    def samples(self):
+        """
+        Yields `(suffix, labels, value)` for every sample of the metric.
+        """
+        if self._func is not None:
+            yield '', '', self._func()
+            return
+        if not self.labelnames and not self._values:
+            yield '', '', 0
+        for labels, value in sorted(self._values.items()):
+            yield '', _format_labels(self.labelnames, labels), value
+
+
+class Counter(Metric):
+    """
+    A count that only goes up. `labels` is a tuple of values for
+    `labelnames`.
+    """
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Gauges made with `func` call it whenever
+    they are read instead of being set.
+    """
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    Counts observations into cumulative `buckets` and keeps their sum.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=default_buckets):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        state = self._values.get(labels)
+        if state is None:
+            # one count per bucket plus +Inf, then sum
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def _summary(self, state):
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+            total += count
+            buckets[bound] = total
+        return {'count': total, 'sum': state[-1], 'buckets': buckets}
+
+    def snapshot(self):
+        if not self.labelnames:
+            state = self._values.get(())
+            return self._summary(state) if state else None
+        return dict((self._key(labels), self._summary(state))
+                    for labels, state in self._values.items())
+
+    def samples(self):
+        for labels, state in sorted(self._values.items()):
+            summary = self._summary(state)
+            for bound, count in summary['buckets'].items():
+                yield '_bucket', _format_labels(
+                    self.labelnames, labels,
+                    'le="{}"'.format(_format_value(bound))), count
+            label_text = _format_labels(self.labelnames, labels)
+            yield '_sum', label_text, summary['sum']
+            yield '_count', label_text, summary['count']
+
+
+class Registry:
+    """
+    The metrics of one service, by name.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError('metric {} already exists'.format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), func=None):
+        return self._add(Counter(name, help, labelnames, func=func))
+
+    def gauge(self, name, help, labelnames=(), func=None):
+        return self._add(Gauge(name, help, labelnames, func=func))
+
+    def histogram(self, name, help, labelnames=(), buckets=default_buckets):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        """
+        Every metric's current value. Labelled metrics map label values to
+        values and histograms give their count, sum and cumulative buckets.
+        """
+        return dict((name, metric.snapshot())
+                    for name, metric in self.metrics.items())
+
+    def prometheus_text(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append('{}{}{} {}'.format(name, suffix, labels,
+                                                _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Answers every HTTP request with the registry in Prometheus text format.
+
+    `address` is `host:port` for TCP or `unix:/path/to/socket`.
+    """
+
+    def __init__(self, registry, address, loop=None, logger=None):
+        self.registry = registry
+        self.address = address
+
+        self._loop = loop
+        self._logger = logger
+        self._server = None
+
+    async def start(self):
+        if self.address.startswith('unix:'):
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self.address[len('unix:'):])
+        else:
+            host, _, port = self.address.rpartition(':')
+            self._server = await asyncio.start_server(
+                self._handle, host=host or None, port=int(port))
+        if self._logger:
+            self._logger.info('serving metrics on {}'.format(self.address))
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            # read and ignore the request line and headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            body = self.registry.prometheus_text().encode('utf-8')
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() +
+                         b'\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
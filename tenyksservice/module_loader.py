@@ -1,7 +1,8 @@
 # came from: http://stackoverflow.com/questions/6811902/import-arbitrary-named-file-as-a-python-module-without-generating-bytecode-file
 import sys
-import imp
 import contextlib
+import importlib.machinery
+import importlib.util
 
 
 @contextlib.contextmanager
@@ -31,20 +32,20 @@ def make_module_from_file(module_name, module_filepath):
             reading the module's Python source.
         :return: The module object.
 
-        The Python import mechanism is not used. No cached bytecode
-        file is created, and no entry is placed in `sys.modules`.
+        The file is loaded as Python source whatever its extension. No
+        cached bytecode file is created, and no entry is placed in
+        `sys.modules`.
 
         """
-    py_source_open_mode = 'rt'
-    py_source_description = (b".py", py_source_open_mode, imp.PY_SOURCE)
-
-    with open(module_filepath, py_source_open_mode) as module_file:
-        with preserve_value(sys, 'dont_write_bytecode'):
-            sys.dont_write_bytecode = True
-            module = imp.load_module(
-                module_name,
-                module_file,
-                module_filepath,
-                py_source_description)
+    loader = importlib.machinery.SourceFileLoader(module_name,
+                                                  module_filepath)
+    spec = importlib.util.spec_from_file_location(module_name,
+                                                  module_filepath,
+                                                  loader=loader)
+    module = importlib.util.module_from_spec(spec)
+
+    with preserve_value(sys, 'dont_write_bytecode'):
+        sys.dont_write_bytecode = True
+        spec.loader.exec_module(module)
 
     return module
@@ -0,0 +1,119 @@
+import asyncio
+import collections
+
+default_outbound_high_water_mark = 1000
+
+
+class OutboundQueue:
+    """
+    Queue of encoded frames waiting to go out to Tenyks.
+
+    A single writer task takes everything that piled up since it last ran,
+    writes it to the stream and drains once for the whole batch. `put` never
+    blocks, so it is safe to call from plain `send`.
+
+    At most `high_water_mark` frames are kept. `put` drops frames beyond that
+    and counts them in `dropped`. Callers that would rather wait than lose
+    replies await `wait_for_room` first, which holds them back while the
+    queue is full.
+
+    If writing to the stream fails the error is logged and whatever was
+    waiting is dropped, so the writer keeps going and `flush` never hangs.
+    """
+
+    def __init__(self, high_water_mark=default_outbound_high_water_mark,
+                 loop=None, logger=None):
+        self.high_water_mark = high_water_mark
+        self.frames_sent = 0
+        self.dropped = 0
+
+        self._loop = loop
+        self._logger = logger
+        self._frames = collections.deque()
+        self._stream = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._dropping = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    def start(self, stream):
+        self._stream = stream
+        self._task = self._loop.create_task(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def put(self, frame):
+        if len(self._frames) >= self.high_water_mark:
+            self.dropped += 1
+            if not self._dropping:
+                # once until there is room again
+                self._dropping = True
+                if self._logger:
+                    self._logger.warning(
+                        'outbound queue is full at {} frames, dropping '
+                        'replies until it drains'.format(self.high_water_mark))
+            return
+        self._frames.append(frame)
+        self._idle.clear()
+        self._wakeup.set()
+        if len(self._frames) >= self.high_water_mark:
+            self._room.clear()
+
+    async def wait_for_room(self):
+        """
+        Waits until `put` would keep a frame. Everyone waiting is woken when
+        the writer makes room, so each checks again in turn and the ones that
+        find the queue full once more keep waiting. Returns straight away if
+        nothing is writing the queue.
+        """
+        while (len(self._frames) >= self.high_water_mark and
+               self._task is not None and not self._task.done()):
+            self._room.clear()
+            await self._room.wait()
+
+    async def flush(self):
+        """
+        Waits until every queued frame has been written and drained.
+        """
+        await self._idle.wait()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._frames:
+                    try:
+                        await self._write_batch()
+                    except Exception:
+                        if self._logger:
+                            self._logger.exception(
+                                'writing to tenyks failed, dropping {} '
+                                'queued frames'.format(len(self._frames)))
+                        self.dropped += len(self._frames)
+                        self._frames.clear()
+                    if len(self._frames) < self.high_water_mark:
+                        self._dropping = False
+                        self._room.set()
+                self._idle.set()
+        finally:
+            # nothing will write these any more, don't leave anyone waiting
+            self._room.set()
+            self._idle.set()
+
+    async def _write_batch(self):
+        for _ in range(len(self._frames)):
+            self._stream.write([self._frames[0]])
+            self._frames.popleft()
+            self.frames_sent += 1
+        await self._stream.drain()
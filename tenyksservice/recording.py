@@ -0,0 +1,154 @@
+"""
+Recording of the raw inbound stream and replay of recordings.
+
+A recording is a short header followed by one record per frame: the time it
+arrived as a big-endian double, its length as a big-endian unsigned int and
+the frame bytes.
+
+    tenyks-service-replay [settings.py] recording.tnkrec [--speed 2 | --max]
+
+replays a recording into a service through the fake hub.
+"""
+import asyncio
+import logging
+import os
+import struct
+import sys
+import time
+
+MAGIC = b'TNKREC1\n'
+_record_header = struct.Struct('>dI')
+
+
+def recording_path(directory, name, worker_index=None):
+    if worker_index is not None:
+        name = '{}-worker{}'.format(name, worker_index)
+    return os.path.join(directory, '{}-inbound-{}.tnkrec'.format(
+        name, time.strftime('%Y%m%d-%H%M%S')))
+
+
+class FrameRecorder:
+    """
+    Appends every frame passed to `record` to the file at `path`. Writes are
+    buffered, so the last few frames only reach the disk on `close`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = 0
+
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def record(self, frame):
+        self._file.write(_record_header.pack(time.time(), len(frame)))
+        self._file.write(frame)
+        self.frames += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_recording(path):
+    """
+    Yields `(timestamp, frame)` for every frame in a recording.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a recording'.format(path))
+        while True:
+            header = f.read(_record_header.size)
+            if len(header) < _record_header.size:
+                return  # end of file, or cut off mid record
+            timestamp, length = _record_header.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                return
+            yield timestamp, frame
+
+
+async def replay(hub, path, speed=1.0):
+    """
+    Sends the frames in a recording through `hub`, spaced out like they
+    arrived divided by `speed`. A `speed` of None sends them as fast as
+    possible. Returns how many frames were sent and how long it took.
+    """
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    first = None
+    sent = 0
+    for timestamp, frame in read_recording(path):
+        if speed:
+            if first is None:
+                first = timestamp
+            delay = start + (timestamp - first) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif sent % 100 == 0:
+            await asyncio.sleep(0)  # let replies in
+        hub.send_frame(frame)
+        sent += 1
+    return sent, loop.time() - start
+
+
+async def run_replay(args, zmq_connection):
+    from .hub import FakeHub
+
+    hub = FakeHub(zmq_connection)
+    replies = []
+    hub.add_reply_callback(lambda data, received_at: replies.append(data))
+    await hub.start()
+    try:
+        if not await hub.wait_for_service(timeout=args.wait):
+            print('no service registered within {} seconds'.format(args.wait))
+            return False
+        hub.start_pinging(args.ping_interval)
+        sent, elapsed = await replay(hub, args.recording,
+                                     None if args.max else args.speed)
+        await asyncio.sleep(args.settle)
+        print('replayed {} frames in {:.2f}s ({:.1f}/s), {} frames back'.format(
+            sent, elapsed, sent / max(elapsed, 1e-9), len(replies)))
+        return True
+    finally:
+        hub.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Replay a recording of inbound frames into a service.')
+    parser.add_argument('settings', nargs='?',
+                        help="service settings file to take ZMQ_CONNECTION "
+                             "from")
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay this many times faster than recorded')
+    parser.add_argument('--max', action='store_true',
+                        help='replay as fast as possible')
+    parser.add_argument('--wait', type=float, default=30,
+                        help='seconds to wait for the service to register')
+    parser.add_argument('--settle', type=float, default=2,
+                        help='seconds to wait for replies after the last frame')
+    parser.add_argument('--ping-interval', type=float, default=30)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s:%(levelname)s '
+                               '%(message)s')
+    from .hub import default_zmq_connection
+    zmq_connection = default_zmq_connection
+    if args.settings:
+        from .module_loader import make_module_from_file
+        zmq_connection = make_module_from_file(
+            'settings', args.settings).ZMQ_CONNECTION
+
+    loop = asyncio.get_event_loop()
+    try:
+        ok = loop.run_until_complete(run_replay(args, zmq_connection))
+    except KeyboardInterrupt:
+        ok = False
+    if not ok:
+        sys.exit(1)
@@ -0,0 +1,287 @@
+import asyncio
+import copy
+import datetime
+import inspect
+import random
+import time
+
+from .executors import CallTimeout, call_with_timeout
+
+job_buckets = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+
+class Every(object):
+    """
+    Runs a job every `interval` seconds, measured from when it was due rather
+    than when the last run finished. Runs missed while the loop was busy are
+    skipped, not made up.
+    """
+
+    def __init__(self, interval, run_at_start=True):
+        if interval <= 0:
+            raise ValueError('interval must be greater than 0')
+        self.interval = interval
+        self.run_at_start = run_at_start
+
+        self._due = None
+
+    def next_delay(self, loop):
+        now = loop.time()
+        if self._due is None:
+            self._due = now if self.run_at_start else now + self.interval
+        else:
+            self._due += self.interval
+            if self._due < now:
+                self._due = now + self.interval
+        return self._due - now
+
+
+_cron_fields = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(text, low, high):
+    values = set()
+    for item in text.split(','):
+        step = 1
+        if '/' in item:
+            item, step = item.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError('bad step in {!r}'.format(text))
+        if item == '*':
+            start, end = low, high
+        elif '-' in item:
+            start, end = (int(v) for v in item.split('-', 1))
+        else:
+            start = int(item)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError('{!r} is out of range {}-{}'.format(text, low,
+                                                                 high))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron(object):
+    """
+    Runs a job on a five field cron schedule in local time:
+    `minute hour day-of-month month day-of-week`. Fields take `*`, numbers,
+    ranges (`1-5`), steps (`*/15`, `0-30/10`) and lists (`1,15`). Day of week
+    is 0-6 from Sunday, and 7 is Sunday too. As in cron, when both day fields
+    are restricted a day matching either one is used.
+    """
+
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError('cron spec needs 5 fields: {!r}'.format(spec))
+        self.spec = spec
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [_parse_cron_field(text, low, high)
+                           for text, (low, high) in zip(fields, _cron_fields)]
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        # as in cron, `*/2` is still unrestricted
+        self._days_restricted = not fields[2].startswith('*')
+        self._weekdays_restricted = not fields[4].startswith('*')
+        self._last = None
+
+    def _day_matches(self, t):
+        in_days = t.day in self.days
+        in_weekdays = (t.weekday() + 1) % 7 in self.weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_time(self, after):
+        """
+        The first time the schedule fires after `after`, a naive datetime.
+        """
+        t = after.replace(second=0, microsecond=0) + \
+            datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) +
+                     datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('cron spec {!r} never fires'.format(self.spec))
+
+    def next_delay(self, loop):
+        now = datetime.datetime.now()
+        # a sleep can end a little early, don't fire twice for the same minute
+        self._last = self.next_time(max(now, self._last or now))
+        return max(0, (self._last - now).total_seconds())
+
+
+class JobSpec(object):
+
+    def __init__(self, schedule, jitter=0, skip_if_running=True, timeout=None):
+        self.schedule = schedule
+        self.jitter = jitter
+        self.skip_if_running = skip_if_running
+        self.timeout = timeout
+
+
+def every(seconds, jitter=0, skip_if_running=True, timeout=None,
+          run_at_start=True):
+    """
+    Runs a service method every `seconds` seconds while the service is
+    running, for work that doesn't wait for a message: refreshing data the
+    handlers read, sending reminders, tidying up.
+
+        @every(600, jitter=30, timeout=60)
+        async def refresh_forecasts(self):
+            self.forecasts = await fetch_forecasts()
+
+    Each run is delayed by up to `jitter` extra seconds. A run that is due
+    while the last one is still going is skipped unless `skip_if_running` is
+    False, and a run is cancelled after `timeout` seconds. Jobs can be
+    `async def`. Put `@offload()` under `@every` to run a blocking job in the
+    thread pool instead of on the loop. An offloaded run can't be stopped, so
+    after `timeout` it keeps going and is only no longer waited for.
+
+    In worker mode jobs only run in the first worker, so they run once per
+    tick rather than once per worker.
+    """
+    return _job_decorator(JobSpec(Every(seconds, run_at_start), jitter,
+                                  skip_if_running, timeout))
+
+
+def cron(spec, jitter=0, skip_if_running=True, timeout=None):
+    """
+    Like `every` but runs on a cron schedule, see `Cron`.
+
+        @cron('0 7 * * 1-5')
+        def morning_report(self):
+            ...
+    """
+    return _job_decorator(JobSpec(Cron(spec), jitter, skip_if_running,
+                                  timeout))
+
+
+def _job_decorator(job_spec):
+    def decorator(func):
+        func._job = job_spec
+        return func
+    return decorator
+
+
+class Job(object):
+    """
+    One job of one service instance. The `JobSpec` set by `every` or `cron`
+    belongs to the class, so every job gets its own copy of the schedule and
+    instances don't share when they are next due.
+    """
+
+    def __init__(self, name, func, spec):
+        self.name = name
+        self.func = func
+        self.spec = spec
+        self.schedule = copy.copy(spec.schedule)
+        self.running = 0
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last_duration = None
+
+
+class Scheduler(object):
+    """
+    Runs the jobs of a service, each in its own task that sleeps until the
+    job is next due. Runs are started as tasks of their own, so a slow run
+    never pushes back the schedule.
+    """
+
+    def __init__(self, loop=None, logger=None, metrics=None,
+                 get_executor=None):
+        self.jobs = {}
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._logger = logger
+        self._get_executor = get_executor
+        self._tasks = []
+        self._metric_runs = None
+        self._metric_duration = None
+        if metrics is not None:
+            self._metric_runs = metrics.counter(
+                'tenyks_job_runs_total', 'Scheduled job runs by outcome.',
+                ['job', 'outcome'])
+            self._metric_duration = metrics.histogram(
+                'tenyks_job_seconds', 'How long scheduled jobs ran for.',
+                ['job'], buckets=job_buckets)
+
+    def add(self, name, func, spec):
+        self.jobs[name] = Job(name, func, spec)
+
+    def add_jobs_from(self, service):
+        """
+        Adds every method of `service` decorated with `every` or `cron`.
+        """
+        for name, attr in inspect.getmembers(type(service)):
+            spec = getattr(attr, '_job', None)
+            if isinstance(spec, JobSpec):
+                self.add(name, getattr(service, name), spec)
+
+    def start(self):
+        for job in self.jobs.values():
+            self._tasks.append(self._loop.create_task(self._schedule(job)))
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _schedule(self, job):
+        spec = job.spec
+        while True:
+            delay = job.schedule.next_delay(self._loop)
+            if spec.jitter:
+                delay += random.uniform(0, spec.jitter)
+            await asyncio.sleep(delay)
+            if job.running and spec.skip_if_running:
+                job.skipped += 1
+                self._count(job, 'skipped')
+                if self._logger:
+                    self._logger.warning('job %s is still running, skipping '
+                                         'this run', job.name)
+                continue
+            self._tasks.append(self._loop.create_task(self._run(job)))
+            self._tasks = [t for t in self._tasks if not t.done()]
+
+    async def _run(self, job):
+        job.running += 1
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            await call_with_timeout(job.func, (), job.spec.timeout, self._loop,
+                                    self._get_executor,
+                                    name='job {}'.format(job.name),
+                                    logger=self._logger)
+        except CallTimeout:
+            outcome = 'timeout'
+            job.timeouts += 1
+        except Exception:
+            outcome = 'error'
+            job.failures += 1
+            if self._logger:
+                self._logger.exception('job %s failed', job.name)
+        finally:
+            job.running -= 1
+            job.runs += 1
+            job.last_duration = time.perf_counter() - start
+            self._count(job, outcome)
+            if self._metric_duration is not None:
+                self._metric_duration.observe(job.last_duration, (job.name,))
+
+    def _count(self, job, outcome):
+        if self._metric_runs is not None:
+            self._metric_runs.inc((job.name, outcome))
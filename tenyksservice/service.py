@@ -1,17 +1,43 @@
 import asyncio
-import inspect
-import json
+import contextvars
+import functools
 import logging
+import os
 import re
+import signal
+import threading
+import time
 import warnings
 
 import aiozmq
 import zmq
 
+from .cache import capture_send
+from .codec import get_codec, default_codec
 from .config import settings, collect_settings
-from .context import ExpirableContext, default_expirable_context_timeout
-from .filters import FilterChain, RegexpFilterChain
-from .packages import six
+from .context import (make_context_store, conversation_key,
+                      default_expirable_context_timeout)
+from .dispatch import Dispatcher, default_dispatch_concurrency
+from .executors import PROCESS, CallTimeout, call_with_timeout, make_executor
+from .flight_recorder import FlightRecorder, IN, OUT
+from .match_budget import IsolatedMatcher
+from .metrics import Registry, MetricsServer
+from .filters import (FilterChain, RegexpFilterChain, CombinedFilterMatcher,
+                      FilterIndex)
+from .outbound import OutboundQueue, default_outbound_high_water_mark
+from .recording import FrameRecorder, recording_path
+from .scheduler import Scheduler, JobSpec, Every
+from .singleflight import SingleFlight
+from .sockets import (connect_subscriber, connect_publisher,
+                      wait_until_connected, close_publisher,
+                      default_connect_timeout, default_hangup_linger)
+from .triage import Triage
+
+default_handler_timeout = 30
+default_slow_filter_threshold = 0.05
+
+# commands from tenyks itself, handled without waiting for DISPATCH_CONCURRENCY
+control_commands = frozenset(['PING', 'HELLO'])
 
 
 class TenyksService:
@@ -21,7 +47,6 @@ class TenyksService:
     logger = None
     version = '0.0'
     command_handlers = {}
-    conversation_context = {}
 
     _required_data_fields = ['command', 'payload']
 
@@ -29,43 +54,184 @@ class TenyksService:
         self.name = name.lower().replace(' ', '')
         self.settings = settings
         self.loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
         self.logger = logging.getLogger(self.name)
-        for f in self.irc_message_filters.values():
-            f._compile_filters()
+        profile_filters = getattr(settings, 'FILTER_PROFILING', False)
+        for name, f in self.irc_message_filters.items():
+            if profile_filters:
+                f.enable_profiling(
+                    name,
+                    getattr(settings, 'SLOW_FILTER_THRESHOLD',
+                            default_slow_filter_threshold),
+                    self.logger)
+            else:
+                f._compile_filters()
+        self._filter_index = FilterIndex(self.irc_message_filters)
+        self._filter_matcher = None
+        # the combined matcher runs many patterns in one scan, so it can't
+        # time them one by one
+        combine_filters = (getattr(self, 'combine_filters', False) and
+                           not profile_filters)
+        self._isolated_matcher = None
+        match_budget = getattr(settings, 'FILTER_MATCH_BUDGET', None)
+        if match_budget and self.irc_message_filters:
+            # the match process combines filters itself
+            self._isolated_matcher = IsolatedMatcher(
+                self.irc_message_filters, match_budget,
+                combine=combine_filters, logger=self.logger, loop=self.loop)
+        elif combine_filters:
+            self._filter_matcher = CombinedFilterMatcher(
+                self.irc_message_filters)
         self.command_handlers = {}
+        self.dispatcher = Dispatcher(
+            self._delegate,
+            concurrency=getattr(settings, 'DISPATCH_CONCURRENCY',
+                                default_dispatch_concurrency),
+            loop=self.loop,
+            logger=self.logger,
+            on_error=self._on_dispatch_error)
+        self._executors = {}
+        self._single_flight = SingleFlight()
+        self._polled_context_keys = set()
+        self.conversation_context = make_context_store(settings)
+        self.conversation_context.add_eviction_callback(self._context_evicted)
+        self.outbound = OutboundQueue(
+            high_water_mark=getattr(settings, 'OUTBOUND_HIGH_WATER_MARK',
+                                    default_outbound_high_water_mark),
+            loop=self.loop,
+            logger=self.logger)
+        self.codec = get_codec(getattr(settings, 'JSON_CODEC', default_codec))
+        self.flight_recorder = None
+        flight_recorder_size = getattr(settings, 'FLIGHT_RECORDER_SIZE', 0)
+        if flight_recorder_size:
+            self.flight_recorder = FlightRecorder(
+                flight_recorder_size,
+                getattr(settings, 'LOG_DIR', None) or os.getcwd(),
+                name=self.name,
+                logger=self.logger)
+        self._build_envelope()
+        self.triage = None
+        if getattr(settings, 'TRIAGE_FRAMES', True):
+            self.triage = Triage()
+        self.recorder = None
+        # set by run_service when running as one of several workers
+        self.worker_index = None
+        self._worker_addrs = None
+        self._setup_metrics()
+        self.scheduler = Scheduler(loop=self.loop, logger=self.logger,
+                                   metrics=self.metrics,
+                                   get_executor=self._get_executor)
+
+    def _setup_metrics(self):
+        self.metrics = Registry()
+        self.metrics_server = None
+        m = self.metrics
+        self._metric_received = m.counter(
+            'tenyks_messages_received_total', 'Frames read from Tenyks.')
+        m.counter('tenyks_messages_dropped_total',
+                  'Frames dropped by triage before decoding.',
+                  func=lambda: self.triage.dropped if self.triage else 0)
+        self._metric_valid = m.counter(
+            'tenyks_messages_valid_total', 'Decoded messages that were valid.')
+        self._metric_invalid = m.counter(
+            'tenyks_messages_invalid_total',
+            'Decoded messages missing required fields.')
+        self._metric_dispatch = m.histogram(
+            'tenyks_dispatch_seconds',
+            'Time spent running the command handlers for a message.',
+            ['command'])
+        self._metric_match_attempts = m.counter(
+            'tenyks_filter_attempts_total',
+            'PRIVMSGs tried against a filter chain.', ['filter'])
+        self._metric_match_hits = m.counter(
+            'tenyks_filter_hits_total',
+            'PRIVMSGs a filter chain matched.', ['filter'])
+        self._metric_handler = m.histogram(
+            'tenyks_handler_seconds', 'Time spent in handle methods.',
+            ['handler'])
+        self._metric_handler_timeouts = m.counter(
+            'tenyks_handler_timeouts_total',
+            'Handle methods that ran out of HANDLER_TIMEOUT. state is '
+            'cancelled, or abandoned for offloaded handlers that keep '
+            'running.',
+            ['handler', 'state'])
+        self._metric_sent = m.counter(
+            'tenyks_messages_sent_total', 'Frames sent to Tenyks.',
+            ['command'])
+        m.counter('tenyks_filter_timeouts_total',
+                  'PRIVMSGs that ran out of FILTER_MATCH_BUDGET.',
+                  func=lambda: (self._isolated_matcher.timeouts
+                                if self._isolated_matcher else 0))
+        m.counter('tenyks_outbound_dropped_total',
+                  'Replies dropped because the outbound queue was full or '
+                  'could not be written.',
+                  func=lambda: self.outbound.dropped)
+        m.gauge('tenyks_outbound_queue_depth',
+                'Replies waiting to be written.',
+                func=lambda: self.outbound.depth)
+        m.gauge('tenyks_dispatch_queue_depth',
+                'Messages waiting for a handler.',
+                func=lambda: self.dispatcher.queue_depth)
+        m.gauge('tenyks_contexts', 'Live conversation contexts.',
+                func=lambda: len(self.conversation_context))
+
+    @property
+    def _speaks_for_service(self):
+        # only one worker registers and says goodbye
+        return self.worker_index in (None, 0)
 
     async def _zmq_connect(self):
+        if self._worker_addrs is not None:
+            # worker mode, the front process talks to tenyks for us
+            in_addr, out_addr = self._worker_addrs
+            self._in = await aiozmq.create_zmq_stream(zmq.PULL,
+                                                      connect=in_addr,
+                                                      loop=self.loop)
+            self._out = await aiozmq.create_zmq_stream(zmq.PUSH,
+                                                       connect=out_addr,
+                                                       loop=self.loop)
+            self.outbound.start(self._out)
+            self.logger.debug('connected to worker front')
+            return
+
         # setup zmq context
         in_addr = self.settings.ZMQ_CONNECTION['in']
         out_addr = self.settings.ZMQ_CONNECTION['out']
-        self._in = await aiozmq.create_zmq_stream(zmq.SUB,
-                                                  connect=in_addr,
-                                                  loop=self.loop)
-        self._out = await aiozmq.create_zmq_stream(zmq.PUB,
-                                                   connect=out_addr,
-                                                   loop=self.loop)
-        self._in.transport.setsockopt(zmq.SUBSCRIBE, b'')
-        self.logger.debug('connected to pubsub sockets')
-        await asyncio.sleep(0.5)
+        self._in = await connect_subscriber(in_addr, loop=self.loop)
+        self._out, subscribed = await connect_publisher(out_addr,
+                                                        loop=self.loop)
+        self.outbound.start(self._out)
+        await wait_until_connected(
+            self._in, subscribed,
+            getattr(self.settings, 'CONNECT_TIMEOUT', default_connect_timeout),
+            logger=self.logger)
 
     async def hangup(self):
         self.logger.debug('hanging up')
-        data = {
-            "command": "BYE",
-            "payload": "",
-            "target": "",
-            "connection": "",
-            "meta": {
-                "name": self.name,
-                "version": self.version,
-                "UUID": self.settings.SERVICE_UUID,
-                "description": self.settings.SERVICE_DESCRIPTION
-            }
-        }
-        self.send('', data)
-        await asyncio.sleep(0.5)
+        if self._speaks_for_service:
+            self._send_command('BYE')
+        self.dispatcher.close()
+        self.scheduler.close()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        linger = getattr(self.settings, 'HANGUP_LINGER',
+                         default_hangup_linger)
+        try:
+            await asyncio.wait_for(self.outbound.flush(), linger)
+        except asyncio.TimeoutError:
+            self.logger.warning('{} frames were not sent before hanging '
+                                'up'.format(self.outbound.depth))
+        self.outbound.close()
+        if self._isolated_matcher is not None:
+            self._isolated_matcher.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if hasattr(self.conversation_context, 'close'):
+            self.conversation_context.close()
         self._in.close()
-        self._out.close()
+        close_publisher(self._out, linger)
         self.logger.debug('closed pubsub sockets')
         self.logger.info('service shutdown')
 
@@ -75,19 +241,7 @@ class TenyksService:
         a HELLO command is recieved.
         """
         self.logger.debug('registering with tenyks')
-        data = {
-            "command": "REGISTER",
-            "payload": "",
-            "target": "",
-            "connection": "",
-            "meta": {
-                "name": self.name,
-                "version": self.version,
-                "UUID": self.settings.SERVICE_UUID,
-                "description": self.settings.SERVICE_DESCRIPTION
-            }
-        }
-        self.send('', data)
+        self._send_command('REGISTER')
 
     async def _help_check(self, data):
         """
@@ -118,7 +272,8 @@ class TenyksService:
                 await self.delegate_to_handle_method(data, match, name)
         else:
             if hasattr(self, 'handle'):
-                self.handle(data, None, None)
+                await self._call_handler(data, self.handle, data, None, None,
+                                         timeout=self._handler_timeout())
 
     def data_is_valid(self, data):
         return all(map(lambda x: x in data.keys(), self._required_data_fields))
@@ -128,50 +283,90 @@ class TenyksService:
             self.command_handlers[command].append(handlefunc)
         else:
             self.command_handlers[command] = [handlefunc]
+        if self.triage is not None:
+            self.triage.configure(self.command_handlers,
+                                  self._privmsg_triage_tokens())
 
-    async def _delegate(self, data):
-        if data['command'].upper() not in self.command_handlers:
-            self.logger.error('Nothing registered to handle {}'
-                              .format(data['command']))
-            return
-        for handler in self.command_handlers[data['command'].upper()]:
-            self.logger.debug('delegating message to {}'.format(handler))
-            await handler(data)
-
-    async def _run_recurring(self):
+    def _privmsg_triage_tokens(self):
         """
-        If you define a method on the service called `recurring`, it will run
-        for `self.recurring_delay` or 30 seconds. This can be used, as an
-        example, to fetch and cache weather data every so often so if a bunch
-        of people in a channel ask for weather a lot, it won't count against
-        your monthly API hits.
+        The payload first tokens this service cares about, or None if it
+        needs to see every PRIVMSG.
         """
-        recurring_delay = getattr(self, 'recurring_delay', 30)
+        base_handlers = [self._help_check, self._privmsg_handler]
+        if self.command_handlers.get('PRIVMSG', base_handlers) != base_handlers:
+            return None  # someone added their own PRIVMSG handler
+        ignore = (hasattr(self, 'pass_on_non_match') and
+                  self.pass_on_non_match)
+        if hasattr(self, 'handle') and not (self.irc_message_filters and
+                                            ignore):
+            return None
+        if not self.irc_message_filters:
+            return {'!help'}
+        tokens = self._filter_index.tokens
+        if tokens is None:
+            return None
+        return tokens | {'!help'}
 
-        while True:
-            self.logger.debug('running periodic task')
-            if inspect.iscoroutinefunction(self.recurring):
-                await self.recurring()
-            else:
-                self.recurring()
-            await asyncio.sleep(recurring_delay)
+    async def _delegate(self, data):
+        command = data['command'].upper()
+        if command not in self.command_handlers:
+            self.logger.error('Nothing registered to handle %s',
+                              data['command'])
+            return
+        start = time.perf_counter()
+        try:
+            for handler in self.command_handlers[command]:
+                self.logger.debug('delegating message to %s', handler)
+                await handler(data)
+        finally:
+            self._metric_dispatch.observe(time.perf_counter() - start,
+                                          (command,))
+
+    def _on_dispatch_error(self):
+        if self.flight_recorder is not None:
+            self.flight_recorder.dump_on_error()
 
     async def _run_context_reaper(self):
+        """
+        Expirable contexts remove themselves through the timer wheel. This
+        only polls contexts that can't tell us when they expire.
+        """
         reaper_delay = getattr(self, 'reaper_delay', 2)
 
         while True:
-            for key in list(self.conversation_context):
-                if self.conversation_context[key].is_expired:
-                    self.logger.debug('removing expired conversation context')
-                    self.conversation_context.pop(key, None)
+            for key in list(self._polled_context_keys):
+                ctx = self.conversation_context.peek(key)
+                if ctx is None:
+                    self._polled_context_keys.discard(key)
+                elif ctx.is_expired:
+                    self._remove_context(key, ctx)
             await asyncio.sleep(reaper_delay)
 
+    def _remove_context(self, key, ctx):
+        self._polled_context_keys.discard(key)
+        if self.conversation_context.peek(key) is ctx:
+            self.logger.debug('removing expired conversation context')
+            self.conversation_context.pop(key, None)
+
+    def _context_evicted(self, key, ctx, reason):
+        self.logger.debug('evicted conversation context %s (%s)', key, reason)
+        self._polled_context_keys.discard(key)
+        if hasattr(ctx, 'cancel'):
+            ctx.cancel()
+
     async def run(self):
+        self._loop_thread = threading.get_ident()
+
         # Connect to ZMQ
         await self._zmq_connect()
 
+        # Don't take messages before filters can be matched.
+        if self._isolated_matcher is not None:
+            await self._isolated_matcher.wait_ready()
+
         # Register with tenyks when we come online.
-        await self._register()
+        if self._speaks_for_service:
+            await self._register()
 
         # Register base handlers
         self.add_command_handler('PING', self._respond_to_ping)
@@ -179,42 +374,208 @@ class TenyksService:
         self.add_command_handler('PRIVMSG', self._help_check)
         self.add_command_handler('PRIVMSG', self._privmsg_handler)
 
+        self.scheduler.add_jobs_from(self)
         if hasattr(self, 'recurring'):
-            self._run_recurring_task = self.loop.create_task(self._run_recurring())
+            # the old single job hook
+            self.scheduler.add('recurring', self.recurring, JobSpec(
+                Every(getattr(self, 'recurring_delay', 30))))
+        if self._speaks_for_service:
+            # with several workers, jobs run in the first one only
+            self.scheduler.start()
 
         self._run_context_reaper_task = self.loop.create_task(self._run_context_reaper())
 
+        if self.flight_recorder is not None:
+            try:
+                self.loop.add_signal_handler(signal.SIGUSR1,
+                                             self.flight_recorder.dump)
+            except (NotImplementedError, AttributeError):
+                pass  # no SIGUSR1 on this platform
+
+        if getattr(self.settings, 'RECORD_INBOUND', False):
+            self.recorder = FrameRecorder(recording_path(
+                getattr(self.settings, 'DATA_WORKING_DIR', None) or os.getcwd(),
+                self.name, self.worker_index))
+            self.logger.info('recording inbound frames to {}'.format(
+                self.recorder.path))
+
+        await self._start_metrics_server()
+
         self.logger.info('starting service {}'.format(self.name))
         while True:
             data = await self._in.read()
-            jdata = json.loads(data[0].decode('utf-8'))
+            await self._receive(data[0])
 
-            self.logger.debug('received: {}'.format(jdata))
-            if not self.data_is_valid(jdata):
-                self.logger.error('message is invalid: {}'.format(jdata))
-                continue
-            await self._delegate(jdata)
+    async def _receive(self, frame):
+        self._metric_received.inc()
+        if self.recorder is not None:
+            self.recorder.record(frame)
+        if self.triage is not None and not self.triage.accepts(frame):
+            return
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(IN, frame)
+        jdata = self.codec.decode(frame)
+
+        self.logger.debug('received: %s', jdata)
+        if not self.data_is_valid(jdata):
+            self._metric_invalid.inc()
+            self.logger.error('message is invalid: %s', jdata)
+            return
+        self._metric_valid.inc()
+        if jdata['command'].upper() in control_commands:
+            # answered as they arrive, not queued behind handlers that are
+            # holding every dispatch slot
+            await self._delegate_control(jdata)
+            return
+        self.dispatcher.submit(conversation_key(jdata), jdata)
+
+    async def _delegate_control(self, data):
+        try:
+            await self._delegate(data)
+        except Exception:
+            self.logger.exception('error handling %s', data['command'])
+            self._on_dispatch_error()
+
+    async def _start_metrics_server(self):
+        """
+        Serves `self.metrics` on METRICS_ADDRESS if it is set. Workers add
+        their index to the port or socket path so they don't collide.
+        """
+        address = getattr(self.settings, 'METRICS_ADDRESS', None)
+        if not address:
+            return
+        if self.worker_index is not None:
+            if address.startswith('unix:'):
+                address = '{}.{}'.format(address, self.worker_index)
+            else:
+                host, _, port = address.rpartition(':')
+                address = '{}:{}'.format(host, int(port) + self.worker_index)
+        self.metrics_server = MetricsServer(self.metrics, address,
+                                            loop=self.loop, logger=self.logger)
+        try:
+            await self.metrics_server.start()
+        except OSError as e:
+            self.logger.error('could not serve metrics on {}: {}'.format(
+                address, e))
+            self.metrics_server = None
+
+    def filter_stats(self):
+        """
+        Match time per pattern, slowest in total first, when FILTER_PROFILING
+        is on.
+        """
+        stats = []
+        for name, f in self.irc_message_filters.items():
+            for pattern_stats in f.pattern_stats or []:
+                entry = pattern_stats.as_dict()
+                entry['filter'] = name
+                stats.append(entry)
+        return sorted(stats, key=lambda entry: entry['total'], reverse=True)
 
     async def search_for_match(self, data):
-        for name, filter_chain in six.iteritems(self.irc_message_filters):
-            if filter_chain.direct_only and not data.get('direct', False):
-                continue
-            if filter_chain.private_only and data.get('from_channel', True):
-                continue
-            match = filter_chain.attempt_match(data['payload'])
+        payload = data['payload']
+        names = tuple(name for name
+                      in self._filter_index.candidates(payload)
+                      if self.irc_message_filters[name].is_eligible(data))
+        attempts = self._metric_match_attempts
+        if self._isolated_matcher is not None or self._filter_matcher:
+            if self._isolated_matcher is not None:
+                name, match = await self._isolated_matcher.attempt_match(
+                    names, payload)
+            else:
+                name, match = self._filter_matcher.attempt_match(names,
+                                                                 payload)
+            # count the chains a chain-by-chain search would have tried
+            for tried in names:
+                attempts.inc((tried,))
+                if tried == name:
+                    break
+            if match:
+                self._metric_match_hits.inc((name,))
+            return name, match
+        for name in names:
+            attempts.inc((name,))
+            match = self.irc_message_filters[name].attempt_match(payload)
             if match:
+                self._metric_match_hits.inc((name,))
                 return name, match
         return None, None
 
     async def delegate_to_handle_method(self, data, match, name):
         handle_method = 'handle_{name}'.format(name=name)
+        start = time.perf_counter()
         if hasattr(self, handle_method):
-            self.logger.debug('calling handle method {}'.format(handle_method))
+            self.logger.debug('calling handle method %s', handle_method)
             callee = getattr(self, handle_method)
-            callee(data, match)
+            try:
+                await self._call_handler(data, callee, data, match,
+                                         timeout=self._handler_timeout(name))
+            finally:
+                self._metric_handler.observe(time.perf_counter() - start,
+                                             (handle_method,))
         else:
             if hasattr(self, 'handle'):
-                self.handle(data, match, name)
+                try:
+                    await self._call_handler(
+                        data, self.handle, data, match, name,
+                        timeout=self._handler_timeout(name))
+                finally:
+                    self._metric_handler.observe(time.perf_counter() - start,
+                                                 ('handle',))
+
+    def _handler_timeout(self, name=None):
+        filter_chain = self.irc_message_filters.get(name)
+        if filter_chain is not None and filter_chain.timeout is not None:
+            return filter_chain.timeout
+        return getattr(self.settings, 'HANDLER_TIMEOUT',
+                       default_handler_timeout)
+
+    def _get_executor(self, kind):
+        executor = self._executors.get(kind)
+        if executor is None:
+            if kind == PROCESS:
+                size = getattr(self.settings, 'PROCESS_POOL_SIZE', None)
+            else:
+                size = getattr(self.settings, 'THREAD_POOL_SIZE', None)
+            executor = self._executors[kind] = make_executor(kind, size)
+        return executor
+
+    async def _call_handler(self, data, callee, *args, timeout=None):
+        """
+        Calls a handle method with `call_with_timeout`. Whatever a process
+        pool handler returns is sent as the reply.
+        """
+        try:
+            result = await call_with_timeout(
+                callee, args, timeout, self.loop, self._get_executor,
+                logger=self.logger)
+        except CallTimeout as e:
+            self._metric_handler_timeouts.inc((callee.__name__, e.state))
+            return None
+
+        offloaded_to = getattr(callee, '_executor', None)
+        if offloaded_to == PROCESS and result is not None:
+            if isinstance(result, str):
+                result = [result]
+            for line in result:
+                self.send(line, data)
+        return result
+
+    async def single_flight(self, key, func, *args, **kwargs):
+        """
+        Calls `func(*args, **kwargs)` and returns what it returns, unless a
+        call with the same `key` is already running, in which case it waits
+        for that one and returns its result instead.
+
+            async def handle_link(self, data, match):
+                url = match.group('url')
+                title = await self.single_flight(url, fetch_title, url)
+                self.send(title, data)
+
+        If the call raises, every caller waiting on it gets the exception.
+        Results aren't kept after the call finishes; see `memoize` for that.
+        """
+        return await self._single_flight.do(key, func, *args, **kwargs)
 
     async def _respond_to_ping(self, data):
         data['command'] = 'PONG'
@@ -222,51 +583,98 @@ class TenyksService:
         self.send('', data)
 
     def _context_key_from_data(self, data):
-        return '{}:{}:{}'.format(
-                data['connection'],
-                data['target'],
-                data['nick'])
+        return conversation_key(data)
 
     def set_expirable_context(self, data, timeout=default_expirable_context_timeout, **kwargs):
-        ctx = ExpirableContext(
+        ctx = self.conversation_context.expirable_context(
                 data,
+                timeout,
                 loop=self.loop,
-                timeout=timeout,
                 logger=self.logger)
         return self.set_context(data, ctx, **kwargs)
 
     def set_context(self, data, ctx, **kwargs):
-        self.conversation_context[self._context_key_from_data(data)] = ctx
-
         for k, v in kwargs.items():
             ctx[k] = v
 
+        key = self._context_key_from_data(data)
+        old_ctx = self.conversation_context.peek(key)
+        if old_ctx is not None and old_ctx is not ctx and hasattr(old_ctx,
+                                                                  'cancel'):
+            old_ctx.cancel()
+        if hasattr(ctx, 'add_expire_callback'):
+            ctx.add_expire_callback(
+                functools.partial(self._remove_context, key))
+        else:
+            self._polled_context_keys.add(key)
+        self.conversation_context[key] = ctx
+
         return ctx
 
     def get_context(self, data):
         return self.conversation_context.get(self._context_key_from_data(data))
 
 
+    def _build_envelope(self):
+        """
+        Everything after the per-message fields never changes, so it is
+        encoded once instead of on every `send`.
+        """
+        self._envelope = self.codec.make_envelope({
+            'name': self.name,
+            'version': self.version or 0.0,
+            'UUID': self.settings.SERVICE_UUID,
+            'description': self.settings.SERVICE_DESCRIPTION
+        })
+
+    def _encode_reply(self, message, data):
+        """
+        Returns the bytes published for `message`.
+        """
+        return self.codec.encode_message(self._envelope, data['command'],
+                                         message, data['target'],
+                                         data['connection'])
+
+    def _send_command(self, command):
+        self.send('', {'command': command, 'target': '', 'connection': ''})
+
     def send(self, message, data=None):
-        if data:
-            to_publish = json.dumps({
-                'command': data['command'],
-                'payload': message,
-                'target': data['target'],
-                'connection': data['connection'],
-                'meta': {
-                    'name': self.name,
-                    'version': self.version or 0.0,
-                    'UUID': self.settings.SERVICE_UUID,
-                    'description': self.settings.SERVICE_DESCRIPTION
-                }
-            })
-        self.logger.debug('sending: {}'.format(to_publish))
-        self._out.write([to_publish.encode('utf-8')])
-        self.loop.create_task(self._out.drain())
-
-
-def run_service(service_class):
+        capture_send(self, message, data)
+        if threading.get_ident() != self._loop_thread:
+            # called from a handler running in the thread pool. the reply has
+            # been captured here already, so don't carry the capture over.
+            self.loop.call_soon_threadsafe(self.send, message, data,
+                                           context=contextvars.Context())
+            return
+        to_publish = self._encode_reply(message, data)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('sending: %s', to_publish.decode('utf-8'))
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(OUT, to_publish)
+        self._metric_sent.inc((data['command'],))
+        self.outbound.put(to_publish)
+
+    async def send_async(self, message, data=None):
+        """
+        Like `send`, but waits while the outbound queue is full instead of
+        dropping the reply. Use this from handlers that send a lot of lines.
+        """
+        await self.outbound.wait_for_room()
+        self.send(message, data)
+
+
+def run_service(service_class, workers=None):
+    """
+    Runs the service until it is interrupted.
+
+    With `workers` greater than one, the service runs in that many processes.
+    A front process owns the connection to Tenyks and shards messages between
+    the workers by `connection:target:nick`, so a conversation's context stays
+    with one worker.
+    """
+    if workers and workers > 1:
+        from .workers import run_workers
+        return run_workers(service_class, workers)
     errors = collect_settings()
     loop = asyncio.get_event_loop()
     service_instance = service_class(settings.SERVICE_NAME, settings)
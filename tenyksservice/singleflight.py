@@ -0,0 +1,61 @@
+import asyncio
+import inspect
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls that share a key.
+
+    The first `do(key, func, ...)` for a key starts `func` in its own task.
+    Every `do` for the same key made before that task finishes waits on the
+    same task and gets the same result, or the same exception. Nothing is
+    kept once the task is done, so the next call starts a new one and a
+    failure is never reused.
+
+    A caller that is cancelled stops waiting, but the call carries on for
+    everyone else. Once every caller has been cancelled, say by a handler
+    timeout, nobody wants the result and the call is cancelled too.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+
+        self._in_flight = {}
+        self._waiters = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._in_flight.get(key)
+        if task is None:
+            result = func(*args, **kwargs)
+            if not inspect.isawaitable(result):
+                return result
+            self.calls += 1
+            task = asyncio.ensure_future(result)
+            self._in_flight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(task) == 1:
+                task.cancel()
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _done(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._waiters.pop(task, None)
+        if not task.cancelled():
+            # everyone waiting may have been cancelled, don't warn about an
+            # exception nobody retrieved
+            task.exception()
@@ -0,0 +1,98 @@
+"""
+Connecting to Tenyks without losing the first messages.
+
+A SUB socket misses whatever is published before its subscription reaches
+the publisher, and a PUB socket drops whatever is sent before a subscriber's
+subscription reaches it. Instead of sleeping and hoping, wait for proof: the
+ZMTP handshake on the subscriber, seen through a socket monitor, and the
+hub's own subscription on the publisher, which is an XPUB so it can read it.
+"""
+import asyncio
+
+import aiozmq
+import zmq
+
+default_connect_timeout = 2
+default_hangup_linger = 1
+
+# running subscription readers, so they aren't garbage collected
+_readers = set()
+
+
+async def connect_subscriber(addr, loop=None):
+    """
+    A SUB stream subscribed to everything and connected to `addr`, with a
+    monitor watching for the handshake. See `wait_until_connected`.
+    """
+    stream = await aiozmq.create_zmq_stream(zmq.SUB, loop=loop)
+    stream.transport.setsockopt(zmq.SUBSCRIBE, b'')
+    # the monitor has to be there before connecting or the event is missed
+    await stream.transport.enable_monitor(zmq.EVENT_HANDSHAKE_SUCCEEDED)
+    await stream.transport.connect(addr)
+    return stream
+
+
+async def connect_publisher(addr, loop=None):
+    """
+    A stream that publishes to `addr`, and an `asyncio.Event` that is set
+    once the hub has subscribed to it. The stream is an XPUB, which sends
+    like a PUB but also receives every subscription. They are read and
+    thrown away for as long as the stream is open so they don't pile up.
+    """
+    stream = await aiozmq.create_zmq_stream(zmq.XPUB, connect=addr, loop=loop)
+    subscribed = asyncio.Event()
+    task = asyncio.ensure_future(_read_subscriptions(stream, subscribed),
+                                 loop=loop)
+    _readers.add(task)
+    task.add_done_callback(_readers.discard)
+    return stream, subscribed
+
+
+async def _read_subscriptions(stream, subscribed):
+    try:
+        while True:
+            await stream.read()
+            subscribed.set()
+    except aiozmq.ZmqStreamClosed:
+        pass
+
+
+async def _handshake(subscriber):
+    try:
+        await subscriber.read_event()
+    finally:
+        # the stream may already be closed when shutting down mid-connect
+        if subscriber.transport is not None:
+            await subscriber.transport.disable_monitor()
+
+
+async def wait_until_connected(subscriber, subscribed, timeout,
+                               logger=None):
+    """
+    Waits until `subscriber` has shaken hands with the hub and the hub has
+    subscribed to the publisher, which sets `subscribed` (see
+    `connect_publisher`). Returns False, and warns that the service is
+    carrying on without it, if that takes longer than `timeout` seconds, say
+    because Tenyks isn't running. The sockets keep trying to connect either
+    way.
+    """
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(_handshake(subscriber), subscribed.wait()), timeout)
+    except asyncio.TimeoutError:
+        if logger:
+            logger.warning('tenyks did not answer within {}s, carrying on '
+                           'and registering when it does'.format(timeout))
+        return False
+    if logger:
+        logger.debug('connected to tenyks')
+    return True
+
+
+def close_publisher(stream, linger):
+    """
+    Closes `stream` once what has been written to it has gone out, waiting
+    no more than `linger` seconds for that.
+    """
+    stream.transport.setsockopt(zmq.LINGER, int(linger * 1000))
+    stream.close()
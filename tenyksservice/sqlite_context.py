@@ -0,0 +1,332 @@
+import collections
+import pickle
+import sqlite3
+import time
+
+from .context import ExpirableContext
+
+default_context_cache_ttl = 1
+default_purge_interval = 30
+# seconds a statement waits for another process's write lock. This runs on
+# the event loop, so keep it short.
+default_busy_timeout = 0.05
+# seconds to leave the database alone after a statement didn't get the lock
+retry_interval = 0.25
+# how long `close` waits to write what is still pending
+close_busy_timeout = 5
+
+
+class SharedContext:
+    """
+    A conversation context that lives in a `SqliteContextStore`, so every
+    process using the same database sees it.
+
+    Works like `ExpirableContext`: values are set with `ctx[key] = value` and
+    `reset()` pushes the expiry back by `timeout` seconds. Changes are written
+    through to the database as soon as they are made. Values have to be
+    picklable.
+    """
+
+    def __init__(self, msg, timeout=None, kv=None, expires_at=None,
+                 store=None, key=None):
+        self.msg = msg
+
+        self._kv = kv or {}
+        self._timeout = timeout
+        self._expires_at = expires_at
+        self._store = store
+        self._key = key
+        if timeout is not None and expires_at is None:
+            self._expires_at = time.time() + timeout
+
+    def __getitem__(self, key):
+        return self._kv[key]
+
+    def __setitem__(self, key, value):
+        self._kv[key] = value
+        self._save()
+
+    def __delitem__(self, key):
+        del self._kv[key]
+        self._save()
+
+    def _save(self):
+        if self._store is not None:
+            self._store._save(self._key, self)
+
+    def reset(self):
+        if self._timeout is not None:
+            self._expires_at = time.time() + self._timeout
+            self._save()
+
+    @property
+    def is_expired(self):
+        return self._expires_at is not None and time.time() >= self._expires_at
+
+
+class SqliteContextStore:
+    """
+    Conversation contexts kept in a SQLite database in WAL mode, so several
+    processes running the same service can share conversation state.
+
+    Expiry is enforced by the store: expired rows are never returned and are
+    deleted every `purge_interval` seconds. Contexts looked up or stored in
+    this process are cached for `cache_ttl` seconds, up to `max_entries` of
+    them, so hot conversations don't hit the database on every message.
+    Another process's changes can take up to `cache_ttl` seconds to show up.
+
+    The database is used from the event loop, so statements wait at most
+    `busy_timeout` seconds for another process's write lock. A write that
+    doesn't get it is kept in this process, counted in `contended` and
+    retried on a later use of the store, and lookups here see it in the
+    meantime.
+
+    Store a `SharedContext`, which `set_expirable_context` creates, to have
+    changes written back. Other picklable objects are stored as they are.
+    An `ExpirableContext` holds the event loop and a timer and can't be
+    stored, so `__setitem__` raises TypeError for it.
+    """
+
+    def __init__(self, path, cache_ttl=default_context_cache_ttl,
+                 max_entries=10000, purge_interval=default_purge_interval,
+                 busy_timeout=default_busy_timeout):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.max_entries = max_entries
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.contended = 0
+
+        self._cache = collections.OrderedDict()
+        # key -> (blob, expires_at), or None for a delete, not written yet
+        self._pending = collections.OrderedDict()
+        self._retry_at = 0
+        self._eviction_callbacks = []
+        self._last_purge = time.monotonic()
+        self._db = sqlite3.connect(path, timeout=busy_timeout,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS contexts ('
+            'key TEXT PRIMARY KEY, context BLOB, expires_at REAL)')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS contexts_expires_at '
+            'ON contexts (expires_at)')
+
+    def __len__(self):
+        cursor = self._execute(
+            'SELECT COUNT(*) FROM contexts '
+            'WHERE expires_at IS NULL OR expires_at > ?', (time.time(),))
+        if cursor is None:
+            return len(self._cache)
+        return cursor.fetchone()[0]
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def __iter__(self):
+        rows = self._execute(
+            'SELECT key FROM contexts '
+            'WHERE expires_at IS NULL OR expires_at > ?', (time.time(),))
+        if rows is None:
+            return iter(list(self._cache))
+        return iter([row[0] for row in rows])
+
+    def __getitem__(self, key):
+        ctx = self.get(key)
+        if ctx is None:
+            raise KeyError(key)
+        return ctx
+
+    def __setitem__(self, key, ctx):
+        if isinstance(ctx, ExpirableContext):
+            raise TypeError(
+                'ExpirableContext is tied to this process and can not be '
+                'stored in the sqlite context backend, use '
+                'set_expirable_context or a SharedContext instead')
+        if isinstance(ctx, SharedContext):
+            ctx._store = self
+            ctx._key = key
+        self._save(key, ctx)
+        self._maybe_purge()
+
+    def __delitem__(self, key):
+        if self.pop(key) is None:
+            raise KeyError(key)
+
+    def add_eviction_callback(self, callback):
+        """
+        Called as `callback(key, None, 'ttl')` for every expired context this
+        process purges from the database.
+        """
+        self._eviction_callbacks.append(callback)
+
+    def expirable_context(self, msg, timeout, loop=None, logger=None):
+        return SharedContext(msg, timeout=timeout)
+
+    def get(self, key, default=None):
+        ctx = self._lookup(key)
+        if ctx is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return ctx
+
+    def peek(self, key, default=None):
+        ctx = self._lookup(key)
+        if ctx is None:
+            return default
+        return ctx
+
+    def pop(self, key, default=None):
+        ctx = self.peek(key)
+        self._cache.pop(key, None)
+        self._pending[key] = None
+        self._pending.move_to_end(key)
+        self._write_pending()
+        if ctx is None:
+            return default
+        return ctx
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'contended': self.contended,
+            'pending': len(self._pending),
+        }
+
+    def _execute(self, sql, params=()):
+        """
+        Runs `sql`, or returns None if another process holds the lock for
+        longer than the busy timeout.
+        """
+        try:
+            return self._db.execute(sql, params)
+        except sqlite3.OperationalError as exc:
+            if 'locked' not in str(exc) and 'busy' not in str(exc):
+                raise
+            self.contended += 1
+            self._retry_at = time.monotonic() + retry_interval
+            return None
+
+    def _write_pending(self, force=False):
+        if not force and time.monotonic() < self._retry_at:
+            return
+        while self._pending:
+            key, entry = next(iter(self._pending.items()))
+            if entry is None:
+                done = self._execute('DELETE FROM contexts WHERE key = ?',
+                                     (key,))
+            else:
+                done = self._execute(
+                    'INSERT OR REPLACE INTO contexts '
+                    '(key, context, expires_at) VALUES (?, ?, ?)',
+                    (key,) + entry)
+            if done is None:
+                return
+            # a newer write for the key may have come in, keep that one
+            if self._pending.get(key) is entry:
+                del self._pending[key]
+
+    def _lookup(self, key):
+        if self._pending:
+            self._write_pending()
+        cached = self._cache.get(key)
+        if cached is not None:
+            ctx, cached_at = cached
+            if time.monotonic() - cached_at < self.cache_ttl:
+                if getattr(ctx, 'is_expired', False):
+                    return None
+                self._cache.move_to_end(key)
+                return ctx
+            del self._cache[key]
+        if key in self._pending:
+            # not written yet, this process has the latest version
+            entry = self._pending[key]
+            if entry is None or (entry[1] is not None and
+                                 entry[1] <= time.time()):
+                return None
+            blob = entry[0]
+        else:
+            cursor = self._execute(
+                'SELECT context FROM contexts WHERE key = ? '
+                'AND (expires_at IS NULL OR expires_at > ?)',
+                (key, time.time()))
+            if cursor is None:
+                # keep using what we had rather than block
+                if cached is not None and not getattr(cached[0], 'is_expired',
+                                                      False):
+                    self._cache_context(key, cached[0])
+                    return cached[0]
+                return None
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            blob = row[0]
+        ctx = pickle.loads(blob)
+        if isinstance(ctx, SharedContext):
+            ctx._store = self
+            ctx._key = key
+        self._cache_context(key, ctx)
+        return ctx
+
+    def _cache_context(self, key, ctx):
+        self._cache[key] = (ctx, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _save(self, key, ctx):
+        if isinstance(ctx, SharedContext):
+            store, ctx._store = ctx._store, None
+            try:
+                blob = pickle.dumps(ctx)
+            finally:
+                ctx._store = store
+            expires_at = ctx._expires_at
+        else:
+            try:
+                blob = pickle.dumps(ctx)
+            except (pickle.PicklingError, TypeError, AttributeError) as exc:
+                raise TypeError('contexts stored in the sqlite context '
+                                'backend have to be picklable: {}'.format(exc))
+            expires_at = None
+        self._pending[key] = (blob, expires_at)
+        self._pending.move_to_end(key)
+        self._cache_context(key, ctx)
+        self._write_pending()
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = time.monotonic()
+        now = time.time()
+        rows = self._execute(
+            'SELECT key FROM contexts WHERE expires_at <= ?', (now,))
+        if rows is None:
+            return
+        expired = [row[0] for row in rows]
+        if not expired:
+            return
+        if self._execute('DELETE FROM contexts WHERE expires_at <= ?',
+                         (now,)) is None:
+            return
+        for key in expired:
+            self._cache.pop(key, None)
+            self.evictions += 1
+            for callback in self._eviction_callbacks:
+                callback(key, None, 'ttl')
+
+    def close(self):
+        if self._pending:
+            self._db.execute('PRAGMA busy_timeout = {}'.format(
+                int(close_busy_timeout * 1000)))
+            self._write_pending(force=True)
+        self._db.close()
@@ -0,0 +1,78 @@
+import re
+
+from .filters import first_token
+
+_command_re = re.compile(br'"command"\s*:\s*"([^"\\]*)"')
+_payload_re = re.compile(br'"payload"\s*:\s*"')
+
+# how far into the payload we look for its first token
+_payload_window = 128
+
+
+class Triage:
+    """
+    Decides from the raw bytes of a frame whether it is worth decoding.
+
+    A frame is dropped when its command has no handler, or when it is a
+    PRIVMSG whose payload starts with a token nothing is listening for. Any
+    frame that can't be judged cheaply (no command field, escapes in the
+    payload's first token, a first token longer than the window) is kept and
+    decoded as usual.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+        self.commands = None
+        self.privmsg_tokens = None
+
+    def configure(self, commands, privmsg_tokens=None):
+        """
+        `commands` are the commands that have handlers. `privmsg_tokens` are
+        the first tokens a PRIVMSG payload needs to be interesting, or None if
+        every PRIVMSG is.
+        """
+        self.commands = frozenset(c.upper().encode('utf-8') for c in commands)
+        if privmsg_tokens is not None:
+            privmsg_tokens = frozenset(privmsg_tokens)
+        self.privmsg_tokens = privmsg_tokens
+
+    def accepts(self, frame):
+        if self.commands is None:
+            return True
+        match = _command_re.search(frame)
+        if match is None:
+            return True
+        command = match.group(1).upper()
+        if command not in self.commands:
+            self.dropped += 1
+            return False
+        if self.privmsg_tokens is None or command != b'PRIVMSG':
+            return True
+        token = self._payload_token(frame)
+        if token is None or token in self.privmsg_tokens:
+            return True
+        self.dropped += 1
+        return False
+
+    def _payload_token(self, frame):
+        match = _payload_re.search(frame)
+        if match is None:
+            return None
+        window = frame[match.end():match.end() + _payload_window]
+        end = window.find(b'"')
+        if end != -1:
+            window = window[:end]
+        try:
+            text = window.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        token = first_token(text)
+        if '\\' in token:
+            return None
+        if end == -1 and len(token) == len(text):
+            # the token might carry on past the window
+            return None
+        if len(token) < len(text) and text[len(token)] == '\\':
+            # an escape could be hiding a word character
+            return None
+        return token
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import tempfile
+import zlib
+
+import aiozmq
+import zmq
+
+from .codec import get_codec, default_codec
+from .config import settings, collect_settings
+from .context import conversation_key
+from .sockets import (connect_subscriber, connect_publisher,
+                      wait_until_connected, close_publisher,
+                      default_connect_timeout, default_hangup_linger)
+
+# seconds the front waits for workers to hang up before terminating them
+worker_shutdown_timeout = 5
+
+_key_fields = [(b'"' + name + b'"',
+                re.compile(b'"' + name + br'"\s*:\s*"([^"\\]*)"'))
+               for name in (b'connection', b'target', b'nick')]
+
+
+def shard_for(data, workers):
+    """
+    Picks the worker for a message. Everything with the same
+    `connection:target:nick` goes to the same worker so conversation context
+    stays in one process.
+    """
+    return zlib.crc32(conversation_key(data).encode('utf-8')) % workers
+
+
+def shard_for_frame(frame, workers, codec):
+    """
+    Like `shard_for` but reads the key straight from the raw frame, so the
+    front doesn't decode every message only to shard it. Frames whose key
+    fields have escapes in them, or aren't strings, are decoded.
+    """
+    parts = []
+    for quoted, field_re in _key_fields:
+        match = field_re.search(frame)
+        if match is not None:
+            parts.append(match.group(1))
+        elif quoted in frame:
+            return shard_for(codec.decode(frame), workers)
+        else:
+            parts.append(b'')
+    return zlib.crc32(b':'.join(parts)) % workers
+
+
+class WorkerFront:
+    """
+    The front process in worker mode. It owns the SUB and PUB sockets to
+    Tenyks, hands every inbound frame to one of the workers over an `ipc://`
+    PUSH socket and publishes whatever the workers push back.
+    """
+
+    def __init__(self, settings, shard_addrs, reply_addr, loop=None,
+                 logger=None):
+        self.settings = settings
+        self.shard_addrs = shard_addrs
+        self.reply_addr = reply_addr
+        self.frames_in = 0
+        self.frames_out = 0
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._logger = logger or logging.getLogger(settings.SERVICE_NAME)
+        self._codec = get_codec(getattr(settings, 'JSON_CODEC',
+                                        default_codec))
+
+    async def connect(self):
+        self._hub_in = await connect_subscriber(
+            self.settings.ZMQ_CONNECTION['in'], loop=self._loop)
+        self._hub_out, subscribed = await connect_publisher(
+            self.settings.ZMQ_CONNECTION['out'], loop=self._loop)
+        self._shards = []
+        for addr in self.shard_addrs:
+            self._shards.append(await aiozmq.create_zmq_stream(
+                zmq.PUSH, bind=addr, loop=self._loop))
+        self._replies, _ = await aiozmq.create_zmq_connection(
+            lambda: _ReplyForwarder(self), zmq.PULL, bind=self.reply_addr,
+            loop=self._loop)
+        await wait_until_connected(
+            self._hub_in, subscribed,
+            getattr(self.settings, 'CONNECT_TIMEOUT', default_connect_timeout),
+            logger=self._logger)
+
+    async def run(self):
+        await self.connect()
+        workers = len(self._shards)
+        while True:
+            frames = await self._hub_in.read()
+            try:
+                index = shard_for_frame(frames[0], workers, self._codec)
+            except (ValueError, AttributeError):
+                index = 0  # let a worker log the bad message
+            self._shards[index].write(frames)
+            self.frames_in += 1
+
+    def _forward_reply(self, frames):
+        self._hub_out.write(frames)
+        self.frames_out += 1
+
+    async def close(self, processes):
+        # workers hang up on SIGTERM. keep forwarding while they do so their
+        # BYE goes out.
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        deadline = self._loop.time() + worker_shutdown_timeout
+        while (any(p.is_alive() for p in processes) and
+               self._loop.time() < deadline):
+            await asyncio.sleep(0.1)
+        for p in processes:
+            if p.is_alive():
+                self._logger.error('killing worker {}'.format(p.pid))
+                p.kill()
+        # the workers are gone, so everything they sent on their way out is
+        # either still in the reply socket or already published
+        linger = getattr(self.settings, 'HANGUP_LINGER',
+                         default_hangup_linger)
+        deadline = self._loop.time() + linger
+        while self._replies_pending() and self._loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        for stream in [self._hub_in, self._replies] + self._shards:
+            stream.close()
+        close_publisher(self._hub_out, linger)
+        self._logger.info('worker front shutdown')
+
+    def _replies_pending(self):
+        return bool(self._replies.getsockopt(zmq.EVENTS) & zmq.POLLIN)
+
+
+class _ReplyForwarder(aiozmq.ZmqProtocol):
+    """
+    Publishes every frame a worker pushes as soon as it is read, so no reply
+    ever waits in a buffer between the two sockets.
+    """
+
+    def __init__(self, front):
+        self._front = front
+
+    def msg_received(self, frames):
+        self._front._forward_reply(frames)
+
+
+def _stop_worker(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def _run_worker(service_class, index, in_addr, out_addr):
+    # ctrl-c reaches the whole process group. the front decides when workers
+    # stop and tells them with SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_worker)
+    collect_settings()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service_instance = service_class(settings.SERVICE_NAME, settings)
+    service_instance.worker_index = index
+    service_instance._worker_addrs = (in_addr, out_addr)
+    try:
+        loop.run_until_complete(service_instance.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(service_instance.hangup())
+    loop.close()
+
+
+def run_workers(service_class, workers):
+    """
+    Runs `workers` copies of `service_class` in their own processes behind a
+    front process that talks to Tenyks. See `run_service`.
+    """
+    errors = collect_settings()
+    logger = logging.getLogger(settings.SERVICE_NAME)
+    for error in errors:
+        logger.error(error)
+
+    ipc_dir = tempfile.mkdtemp(prefix='tenyks-{}-'.format(
+        settings.SERVICE_NAME))
+    shard_addrs = ['ipc://{}'.format(os.path.join(ipc_dir,
+                                                  'worker-{}'.format(i)))
+                   for i in range(workers)]
+    reply_addr = 'ipc://{}'.format(os.path.join(ipc_dir, 'replies'))
+
+    loop = asyncio.get_event_loop()
+    front = WorkerFront(settings, shard_addrs, reply_addr, loop=loop,
+                        logger=logger)
+    spawn = multiprocessing.get_context('spawn')
+    processes = [spawn.Process(target=_run_worker,
+                               args=(service_class, i, shard_addrs[i],
+                                     reply_addr))
+                 for i in range(workers)]
+    for p in processes:
+        p.start()
+    logger.info('started {} workers'.format(workers))
+    try:
+        loop.run_until_complete(front.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(front.close(processes))
+        shutil.rmtree(ipc_dir, ignore_errors=True)
+    loop.close()
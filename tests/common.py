@@ -0,0 +1,68 @@
+"""
+Shared helpers for the tests: a service wired up the way `run` does it, but
+without any sockets.
+"""
+import asyncio
+import json
+
+from tenyksservice import TenyksService
+
+
+class TestSettings(object):
+    SERVICE_UUID = '273b62ad-a99d-48be-8d80-ccc55ef688b4'
+    SERVICE_DESCRIPTION = 'Hello service will let you greet Tenyks'
+
+
+class ListStream(object):
+    """
+    Stands in for the PUB stream. Frames written to it are kept, decoded.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frames):
+        for frame in frames:
+            self.frames.append(json.loads(frame.decode('utf-8')))
+
+    async def drain(self):
+        pass
+
+
+def make_service(loop, attrs=None, **settings):
+    """
+    An instance of a `TenyksService` subclass with `attrs`, running on `loop`
+    with the base command handlers registered. Replies end up in
+    `service.stream.frames`.
+    """
+    asyncio.set_event_loop(loop)
+    service_class = type('TestService', (TenyksService,), dict(attrs or {}))
+    test_settings = TestSettings()
+    for key, value in settings.items():
+        setattr(test_settings, key, value)
+    service = service_class('test', test_settings)
+    service.stream = ListStream()
+    service.outbound.start(service.stream)
+    service.add_command_handler('PING', service._respond_to_ping)
+    service.add_command_handler('HELLO', service._register)
+    service.add_command_handler('PRIVMSG', service._help_check)
+    service.add_command_handler('PRIVMSG', service._privmsg_handler)
+    return service
+
+
+def close_service(service):
+    service.dispatcher.close()
+    service.outbound.close()
+    service.loop.run_until_complete(asyncio.sleep(0))
+
+
+def privmsg(payload, nick='kyle', target='#tenyks'):
+    return {
+        'command': 'PRIVMSG',
+        'payload': payload,
+        'target': target,
+        'connection': 'freenode',
+        'nick': nick,
+        'from_channel': True,
+        'direct': False,
+    }
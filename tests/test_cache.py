@@ -0,0 +1,173 @@
+import asyncio
+import re
+import unittest
+from unittest import mock
+
+from tenyksservice.cache import capture_send, memoize
+
+
+class FakeService:
+    """
+    Records replies the way `TenyksService.send` would hand them to the cache.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message, data):
+        capture_send(self, message, data)
+        self.sent.append((message, data))
+
+
+class MemoizeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch('tenyksservice.cache.time.monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def test_hits_until_ttl(self):
+        @memoize(ttl=10)
+        def square(n):
+            self.calls.append(n)
+            return n * n
+
+        self.assertEqual([square(3), square(3), square(4)], [9, 9, 16])
+        self.now = 10
+        self.assertEqual(square(3), 9)
+        self.assertEqual(self.calls, [3, 4, 3])
+        info = square.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 3, 2))
+        square.cache_clear()
+        self.assertEqual(square.cache_info().currsize, 0)
+
+    def test_maxsize_evicts_least_recently_used(self):
+        @memoize(maxsize=2)
+        def ident(n):
+            self.calls.append(n)
+            return n
+
+        ident(1)
+        ident(2)
+        ident(1)
+        ident(3)
+        ident(1)
+        ident(2)
+        self.assertEqual(self.calls, [1, 2, 3, 2])
+
+    def test_none_only_cached_with_negative_ttl(self):
+        @memoize()
+        def nothing():
+            self.calls.append(None)
+
+        nothing()
+        nothing()
+        self.assertEqual(len(self.calls), 2)
+
+        @memoize(ttl=60, negative_ttl=5)
+        def briefly_nothing():
+            self.calls.append(None)
+
+        briefly_nothing()
+        briefly_nothing()
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(briefly_nothing.cache_info().negative_hits, 1)
+        self.now = 5
+        briefly_nothing()
+        self.assertEqual(len(self.calls), 4)
+
+    def test_exceptions_are_not_cached(self):
+        @memoize()
+        def fail():
+            self.calls.append(None)
+            raise ValueError()
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                fail()
+        self.assertEqual(len(self.calls), 2)
+
+    def test_unhashable_arguments_ask_for_a_key(self):
+        @memoize()
+        def lookup(things):
+            return len(things)
+
+        with self.assertRaisesRegex(TypeError, 'groups= or key='):
+            lookup(['a'])
+
+        @memoize(key=lambda things: tuple(things))
+        def keyed(things):
+            self.calls.append(things)
+            return len(things)
+
+        keyed(['a'])
+        keyed(['a'])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_handle_method_keyed_on_groups_replays_replies(self):
+        test = self
+
+        class Service(FakeService):
+            @memoize(groups=['location'])
+            def handle_weather(self, data, match):
+                test.calls.append(data)
+                self.send('sunny in ' + match.group('location'), data)
+
+        service = Service()
+        pattern = re.compile(r'!weather (?P<location>\w+)')
+        first = {'nick': 'kyle', 'payload': '!weather seattle'}
+        second = {'nick': 'amy', 'payload': '!weather  seattle'}
+        service.handle_weather(first, pattern.match('!weather seattle'))
+        service.handle_weather(second, pattern.match('!weather seattle'))
+        self.assertEqual(self.calls, [first])
+        self.assertEqual(service.sent, [('sunny in seattle', first),
+                                        ('sunny in seattle', second)])
+
+    def test_handle_method_without_groups_keyed_on_payload(self):
+        test = self
+
+        class Service(FakeService):
+            @memoize()
+            def handle_echo(self, data, match):
+                test.calls.append(data)
+                self.send(data['payload'], data)
+
+        service = Service()
+        match = re.match(r'.*', '')
+        service.handle_echo({'nick': 'kyle', 'payload': 'hi'}, match)
+        service.handle_echo({'nick': 'amy', 'payload': 'hi'}, match)
+        service.handle_echo({'nick': 'amy', 'payload': 'bye'}, match)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([m for m, _ in service.sent], ['hi', 'hi', 'bye'])
+        self.assertEqual(service.sent[1][1]['nick'], 'amy')
+
+    def test_concurrent_coroutine_misses_are_coalesced(self):
+        test = self
+
+        class Service(FakeService):
+            @memoize()
+            async def fetch(self, name):
+                test.calls.append(name)
+                # the event loop's clock is patched too, so don't sleep
+                await released.wait()
+                return name.upper()
+
+        service = Service()
+
+        async def main():
+            calls = asyncio.gather(
+                *[service.fetch('a') for _ in range(5)], service.fetch('b'))
+            for _ in range(3):
+                await asyncio.sleep(0)
+            released.set()
+            return await calls
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        released = asyncio.Event()
+        self.assertEqual(loop.run_until_complete(main()),
+                         ['A'] * 5 + ['B'])
+        self.assertEqual(sorted(self.calls), ['a', 'b'])
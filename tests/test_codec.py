@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from tenyksservice.codec import JSONCodec, codecs, get_codec
+
+MESSAGES = [
+    {'command': 'PING', 'payload': '', 'target': '', 'connection': ''},
+    {'command': 'HELLO', 'payload': '', 'target': '', 'connection': ''},
+    {'command': 'PRIVMSG', 'payload': "hi, I'm kyle", 'target': '#tenyks',
+     'connection': 'freenode', 'nick': 'kyle', 'host': 'unaffiliated/kyle',
+     'full_message': ":kyle!~kyle@unaffiliated/kyle PRIVMSG #tenyks :tenyks: "
+                     "hi, I'm kyle",
+     'user': '~kyle', 'from_channel': True, 'direct': True},
+    {'command': 'PRIVMSG', 'payload': '!weather Zürich ☔', 'target': 'tenyks',
+     'connection': 'freenode', 'nick': 'søren', 'from_channel': False,
+     'direct': True},
+    {'command': 'PRIVMSG', 'payload': 'quotes " and \\ and \t tabs\n',
+     'target': '#tenyks', 'connection': 'freenode', 'nick': 'kyle',
+     'from_channel': True, 'direct': False},
+    {'command': 'PRIVMSG', 'payload': 'emoji \U0001f600 and   separators',
+     'target': '#tenyks', 'connection': 'freenode', 'nick': 'kyle',
+     'from_channel': True, 'direct': False},
+]
+META = {
+    'name': 'hello',
+    'version': '0.1.1',
+    'UUID': '273b62ad-a99d-48be-8d80-ccc55ef688b4',
+    'description': 'Hello service will let you greet Tenyks',
+}
+REPLIES = ['How are you kyle?!', 'Zürich: 12°C ☔', 'a "quoted" \\ reply', '']
+
+
+def installed_codecs():
+    for name in codecs:
+        codec = get_codec(name)
+        if codec.name == name:
+            yield codec
+
+
+class CodecParityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = JSONCodec()
+
+    def test_decode_matches_json(self):
+        for codec in installed_codecs():
+            for message in MESSAGES:
+                frame = self.reference.encode(message)
+                self.assertEqual(codec.decode(frame), json.loads(frame),
+                                 codec.name)
+
+    def test_encode_message_matches_json(self):
+        for codec in installed_codecs():
+            envelope = codec.make_envelope(META)
+            for message in MESSAGES:
+                for reply in REPLIES:
+                    encoded = codec.encode_message(
+                        envelope, message['command'], reply,
+                        message['target'], message['connection'])
+                    self.assertEqual(json.loads(encoded), {
+                        'command': message['command'],
+                        'payload': reply,
+                        'target': message['target'],
+                        'connection': message['connection'],
+                        'meta': META,
+                    }, codec.name)
+
+    def test_json_codec_gives_json_dumps_bytes(self):
+        envelope = self.reference.make_envelope(META)
+        encoded = self.reference.encode_message(
+            envelope, 'PRIVMSG', REPLIES[1], '#tenyks', 'freenode')
+        self.assertEqual(encoded, json.dumps({
+            'command': 'PRIVMSG',
+            'payload': REPLIES[1],
+            'target': '#tenyks',
+            'connection': 'freenode',
+            'meta': META,
+        }).encode('utf-8'))
+
+    def test_encode_message_handles_non_str_fields(self):
+        envelope = self.reference.make_envelope(META)
+        encoded = self.reference.encode_message(envelope, 'PRIVMSG', 42,
+                                                '#tenyks', 'freenode')
+        self.assertEqual(json.loads(encoded)['payload'], 42)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, 'yaml')
+
+
+if __name__ == '__main__':
+    unittest.main()
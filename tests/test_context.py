@@ -0,0 +1,173 @@
+import unittest
+from unittest import mock
+
+from tenyksservice.context import ContextStore, ExpirableContext, TimerWheel
+
+
+class FakeLoop:
+    """
+    Just enough of an event loop for a timer wheel, with a clock that only
+    moves when the test says so.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.callbacks = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        self.callbacks.append((self.now + delay, callback))
+        return callback
+
+    def advance(self, seconds):
+        self.now += seconds
+        while True:
+            due = [c for c in self.callbacks if c[0] <= self.now]
+            if not due:
+                break
+            for entry in due:
+                self.callbacks.remove(entry)
+                entry[1]()
+
+
+class TimerWheelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.wheel = TimerWheel(self.loop, resolution=0.5, slots=8)
+        self.expired = []
+
+    def context(self, timeout):
+        ctx = ExpirableContext({}, loop=self.loop, timeout=timeout,
+                               timer=self.wheel)
+        ctx.add_expire_callback(self.expired.append)
+        return ctx
+
+    def test_context_expires_after_its_timeout(self):
+        ctx = self.context(2)
+        self.loop.advance(1.5)
+        self.assertFalse(ctx.is_expired)
+        self.loop.advance(0.5)
+        self.assertTrue(ctx.is_expired)
+        self.assertEqual(self.expired, [ctx])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_reset_pushes_the_deadline_back(self):
+        ctx = self.context(2)
+        self.loop.advance(1.5)
+        ctx.reset()
+        self.loop.advance(1.5)
+        self.assertFalse(ctx.is_expired)
+        self.loop.advance(0.5)
+        self.assertTrue(ctx.is_expired)
+        self.assertEqual(len(self.expired), 1)
+
+    def test_cancelled_context_never_expires(self):
+        ctx = self.context(1)
+        ctx.cancel()
+        self.assertEqual(len(self.wheel), 0)
+        self.loop.advance(5)
+        self.assertFalse(ctx.is_expired)
+        self.assertEqual(self.expired, [])
+
+    def test_deadlines_further_out_than_the_wheel(self):
+        # 8 slots of half a second wrap around every 4 seconds
+        near = self.context(1)
+        far = self.context(9)
+        self.loop.advance(5)
+        self.assertTrue(near.is_expired)
+        self.assertFalse(far.is_expired)
+        self.loop.advance(4)
+        self.assertTrue(far.is_expired)
+        self.assertEqual(self.expired, [near, far])
+
+    def test_no_callback_on_the_loop_while_empty(self):
+        self.context(1)
+        self.loop.advance(1)
+        self.assertEqual(self.loop.callbacks, [])
+        # after sleeping through ticks a new deadline is still honoured
+        self.loop.advance(100)
+        ctx = self.context(1)
+        self.loop.advance(0.5)
+        self.assertFalse(ctx.is_expired)
+        self.loop.advance(0.5)
+        self.assertTrue(ctx.is_expired)
+
+
+class ContextStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch('tenyksservice.context.time.monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.evicted = []
+
+    def store(self, **kwargs):
+        store = ContextStore(**kwargs)
+        store.add_eviction_callback(
+            lambda key, ctx, reason: self.evicted.append((key, reason)))
+        return store
+
+    def test_least_recently_used_is_evicted_first(self):
+        store = self.store(max_entries=2)
+        store['a'] = {}
+        store['b'] = {}
+        store.get('a')
+        store['c'] = {}
+        self.assertEqual(sorted(store), ['a', 'c'])
+        self.assertEqual(self.evicted, [('b', 'size')])
+        self.assertEqual(store.evictions, 1)
+
+    def test_peek_does_not_count_as_a_use(self):
+        store = self.store(max_entries=2)
+        store['a'] = {}
+        store['b'] = {}
+        store.peek('a')
+        store['c'] = {}
+        self.assertNotIn('a', store)
+        self.assertEqual(store.hits, 0)
+
+    def test_max_bytes_evicts_but_keeps_the_newest(self):
+        store = self.store(max_bytes=1)
+        store['a'] = {'x': 'y'}
+        store['b'] = {'x': 'y'}
+        self.assertEqual(list(store), ['b'])
+        self.assertEqual(self.evicted, [('a', 'size')])
+        self.assertEqual(store.bytes, store.stats()['bytes'])
+        self.assertGreater(store.bytes, 0)
+
+    def test_idle_contexts_are_evicted_after_ttl(self):
+        store = self.store(ttl=10)
+        store['a'] = {}
+        store['b'] = {}
+        self.now = 6
+        store.get('b')
+        self.now = 11
+        self.assertIsNone(store.get('a'))
+        self.assertIsNotNone(store.get('b'))
+        self.assertEqual(self.evicted, [('a', 'ttl')])
+
+    def test_pop_and_del_are_not_evictions(self):
+        store = self.store()
+        store['a'] = {}
+        store['b'] = {}
+        self.assertEqual(store.pop('a'), {})
+        del store['b']
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.bytes, 0)
+        self.assertEqual(self.evicted, [])
+        with self.assertRaises(KeyError):
+            store['b']
+
+    def test_stats_count_hits_and_misses(self):
+        store = self.store()
+        store['a'] = {}
+        store.get('a')
+        store.get('missing')
+        stats = store.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']),
+                         (1, 1, 1))
@@ -0,0 +1,95 @@
+import asyncio
+import random
+import unittest
+
+from tenyksservice.dispatch import Dispatcher
+
+
+class DispatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_until_idle(self, dispatcher):
+        async def wait():
+            while dispatcher.conversations:
+                await asyncio.sleep(0)
+        self.loop.run_until_complete(asyncio.wait_for(wait(), 5))
+
+    def test_messages_for_a_key_are_handled_in_order(self):
+        handled = []
+
+        async def handler(message):
+            # finish out of submission order if ordering isn't kept
+            await asyncio.sleep(random.random() / 1000)
+            handled.append(message)
+
+        dispatcher = Dispatcher(handler, concurrency=4, loop=self.loop)
+        for index in range(20):
+            for key in ('a', 'b', 'c'):
+                dispatcher.submit(key, (key, index))
+        self.run_until_idle(dispatcher)
+
+        self.assertEqual(len(handled), 60)
+        for key in ('a', 'b', 'c'):
+            self.assertEqual([i for k, i in handled if k == key],
+                             list(range(20)))
+        self.assertEqual(dispatcher.queue_depth, 0)
+
+    def test_keys_run_concurrently_up_to_the_limit(self):
+        running = []
+        peak = []
+
+        async def handler(message):
+            running.append(message)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(message)
+
+        dispatcher = Dispatcher(handler, concurrency=3, loop=self.loop)
+        for key in range(10):
+            dispatcher.submit(key, key)
+        self.run_until_idle(dispatcher)
+
+        self.assertEqual(max(peak), 3)
+
+    def test_one_key_never_runs_two_messages_at_once(self):
+        running = []
+        overlaps = []
+
+        async def handler(message):
+            if running:
+                overlaps.append(message)
+            running.append(message)
+            await asyncio.sleep(0)
+            running.remove(message)
+
+        dispatcher = Dispatcher(handler, concurrency=10, loop=self.loop)
+        for index in range(5):
+            dispatcher.submit('a', index)
+        self.run_until_idle(dispatcher)
+
+        self.assertEqual(overlaps, [])
+
+    def test_errors_are_reported_and_the_queue_keeps_going(self):
+        handled = []
+        errors = []
+
+        async def handler(message):
+            if message == 1:
+                raise ValueError('boom')
+            handled.append(message)
+
+        dispatcher = Dispatcher(handler, loop=self.loop,
+                                on_error=lambda: errors.append(1))
+        for index in range(3):
+            dispatcher.submit('a', index)
+        self.run_until_idle(dispatcher)
+
+        self.assertEqual(handled, [0, 2])
+        self.assertEqual(errors, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import re
+import threading
+import unittest
+
+from tenyksservice.executors import (PROCESS, THREAD, CallTimeout, MatchResult,
+                                     call_with_timeout, make_executor,
+                                     offload)
+
+
+@offload(PROCESS)
+def describe_match(match):
+    return type(match).__name__, match.group('name')
+
+
+class CallWithTimeoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.executors = {}
+
+    def get_executor(self, kind):
+        executor = self.executors.get(kind)
+        if executor is None:
+            executor = self.executors[kind] = make_executor(kind, 1)
+            self.addCleanup(executor.shutdown)
+        return executor
+
+    def call(self, func, *args, timeout=1):
+        return self.loop.run_until_complete(call_with_timeout(
+            func, args, timeout, self.loop, self.get_executor))
+
+    def test_plain_and_coroutine_functions(self):
+        async def double(n):
+            return n * 2
+
+        self.assertEqual(self.call(lambda n: n + 1, 1), 2)
+        self.assertEqual(self.call(double, 2), 4)
+
+    def test_coroutines_are_cancelled(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        with self.assertRaises(CallTimeout) as raised:
+            self.call(slow, timeout=0.01)
+        self.assertEqual(raised.exception.state, 'cancelled')
+        self.assertEqual(cancelled, [True])
+
+    def test_offloaded_calls_are_abandoned(self):
+        release = threading.Event()
+        threads = []
+
+        @offload(THREAD)
+        def blocking():
+            threads.append(threading.get_ident())
+            release.wait(1)
+
+        with self.assertRaises(CallTimeout) as raised:
+            self.call(blocking, timeout=0.01)
+        release.set()
+        self.assertEqual(raised.exception.state, 'abandoned')
+        self.assertNotEqual(threads, [threading.get_ident()])
+
+    def test_process_pool_functions_get_match_results(self):
+        match = re.match(r'hi (?P<name>\w+)', 'hi kyle')
+        self.assertEqual(self.call(describe_match, match, timeout=30),
+                         (MatchResult.__name__, 'kyle'))
+
+    def test_process_pool_methods_are_refused(self):
+        class Service(object):
+            @offload(PROCESS)
+            def handle_crunch(self):
+                pass
+
+        with self.assertRaisesRegex(TypeError, 'has to be a static method'):
+            self.call(Service().handle_crunch)
@@ -0,0 +1,218 @@
+import asyncio
+import re
+import unittest
+from unittest import mock
+
+from tenyksservice import filters
+from tenyksservice.filters import (CombinedFilterMatcher, FilterChain,
+                                   FilterIndex, literal_prefix_tokens)
+
+from tests.common import close_service, make_service, privmsg
+
+
+def compiled(filter_chains):
+    for chain in filter_chains.values():
+        chain._compile_filters()
+    return filter_chains
+
+
+def sequential_match(filter_chains, names, message):
+    for name in names:
+        match = filter_chains[name].attempt_match(message)
+        if match:
+            return name, match
+    return None, None
+
+
+class CombinedFilterMatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.chains = compiled({
+            'hello': FilterChain(
+                [r"^(hi|hello|sup|hey), I'm (?P<name>(.*))$"]),
+            'weather': FilterChain([r'^!weather\s+(?P<location>.*)$',
+                                    r'^!weather$']),
+            'repeat': FilterChain([r'^(?P<word>\w+) (?P=word)$']),
+            'numbered': FilterChain([r'^(\w+)-\1$']),
+            'shout': FilterChain([r'(?i)^hey there']),
+            'scoped': FilterChain([r'^(?i:psst)\b']),
+            'callable': FilterChain(
+                [re.compile(r'^!call (?P<who>\w+)').match]),
+            'anything': FilterChain([r'.*(?P<url>https?://\S+)']),
+        })
+        self.names = tuple(self.chains)
+        self.matcher = CombinedFilterMatcher(self.chains)
+
+    def assertSameMatch(self, names, message):
+        name, match = self.matcher.attempt_match(names, message)
+        expected_name, expected = sequential_match(self.chains, names, message)
+        self.assertEqual(name, expected_name, message)
+        if expected is None:
+            self.assertIsNone(match, message)
+            return
+        self.assertIs(match.re, expected.re)
+        self.assertEqual(match.span(), expected.span())
+        self.assertEqual(match.groups(), expected.groups())
+        self.assertEqual(match.groupdict(), expected.groupdict())
+
+    def test_same_results_as_matching_chain_by_chain(self):
+        messages = [
+            "hi, I'm kyle", "hey, I'm amy", '!weather seattle', '!weather',
+            '!weathers', 'hello hello', 'hello there', 'ab-ab', 'ab-cd',
+            'HEY THERE', 'PSST, over here', 'psst', '!call kyle',
+            'see https://example.com', "hi, I'm at https://example.com",
+            '', 'nothing here',
+        ]
+        for message in messages:
+            self.assertSameMatch(self.names, message)
+            self.assertSameMatch(tuple(reversed(self.names)), message)
+
+    def test_first_chain_in_order_wins(self):
+        message = "hi, I'm at https://example.com"
+        self.assertEqual(self.matcher.attempt_match(
+            ('hello', 'anything'), message)[0], 'hello')
+        self.assertEqual(self.matcher.attempt_match(
+            ('anything', 'hello'), message)[0], 'anything')
+
+    def test_named_groups_and_backreferences_keep_their_names(self):
+        name, match = self.matcher.attempt_match(self.names, 'hello hello')
+        self.assertEqual(name, 'repeat')
+        self.assertEqual(match.groupdict(), {'word': 'hello'})
+        self.assertEqual(self.matcher.attempt_match(self.names, 'hi ho'),
+                         (None, None))
+
+    def test_uncombinable_patterns_are_their_own_step(self):
+        engine = self.matcher._build_engine(self.names)
+        standalone = [lookup[0] for combined, lookup in engine
+                      if combined is None]
+        self.assertEqual(standalone, ['numbered', 'shout', 'callable'])
+        combined = set(name for combined, lookup in engine
+                       if combined is not None
+                       for name, _ in lookup.values())
+        self.assertEqual(combined, {'hello', 'weather', 'repeat', 'scoped',
+                                    'anything'})
+        # the steps between standalone patterns keep the original order
+        order = []
+        for combined, lookup in engine:
+            if combined is None:
+                order.append(lookup[0])
+            else:
+                order.extend(sorted(
+                    set(name for name, _ in lookup.values()),
+                    key=self.names.index))
+        self.assertEqual(order, list(self.names))
+
+    def test_engines_are_built_once_per_set_of_chains(self):
+        self.matcher.attempt_match(('hello', 'weather'), 'x')
+        self.matcher.attempt_match(('hello', 'weather'), 'y')
+        self.matcher.attempt_match(('weather',), 'y')
+        self.assertEqual(len(self.matcher._engines), 2)
+
+
+class CombinedSearchForMatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.service = make_service(self.loop, {
+            'combine_filters': True,
+            'irc_message_filters': {
+                'direct': FilterChain([r'^!secret$'], direct_only=True),
+                'private': FilterChain([r'^!secret$'], private_only=True),
+                'public': FilterChain([r'^!secret$']),
+            },
+        })
+        self.addCleanup(close_service, self.service)
+
+    def search(self, **fields):
+        data = privmsg('!secret')
+        data.update(fields)
+        return self.loop.run_until_complete(
+            self.service.search_for_match(data))[0]
+
+    def test_direct_only_and_private_only_chains_are_skipped(self):
+        self.assertIsNotNone(self.service._filter_matcher)
+        self.assertEqual(self.search(), 'public')
+        self.assertEqual(self.search(direct=True), 'direct')
+        self.assertEqual(self.search(from_channel=False), 'private')
+        self.assertEqual(self.search(direct=True, from_channel=False),
+                         'direct')
+
+
+class LiteralPrefixTokensTestCase(unittest.TestCase):
+
+    cases = [
+        # a token could carry on past the literal: !weathers
+        (r'^!weather', None),
+        (r'^!weather\s+', {'!weather'}),
+        (r'^!weather$', {'!weather'}),
+        (r'^!weather\b', {'!weather'}),
+        (r'!weather ', {'!weather'}),
+        (r'\bhi\b', {'hi'}),
+        (r"^(hi|hello|sup|hey), I'm (?P<name>.*)",
+         {'hi', 'hello', 'sup', 'hey'}),
+        (r'^!(weather|forecast)\s+(?P<location>.*)',
+         {'!weather', '!forecast'}),
+        (r'^(?:!w|!weather)\s', {'!w', '!weather'}),
+        (r'^[!.]help$', {'!help', '.help'}),
+        (r'(?i)^!weather\s', None),
+        (r'^(?i:!weather)\s', None),
+        (r'^!weather\s*', None),
+        (r'^(?=!)!weather\s', None),
+        (r'^!weather(?=\s)', None),
+        (r'^!cmd\d', None),
+        (r'^\s*hi\s', None),
+        (r'.*word', None),
+        (r'^!!!$', None),
+        (r'^(unclosed', None),
+    ]
+
+    def test_prefix_tokens(self):
+        for pattern, expected in self.cases:
+            self.assertEqual(literal_prefix_tokens(pattern), expected,
+                             pattern)
+
+    def test_compiled_patterns_are_not_indexed(self):
+        self.assertIsNone(literal_prefix_tokens(re.compile(r'^!weather\s')))
+        self.assertIsNone(literal_prefix_tokens(
+            re.compile(r'^!weather\s').match))
+
+    def test_unexpected_parser_output_is_not_indexed(self):
+        with mock.patch.object(filters.sre_parse, 'parse',
+                               return_value=[('surprise', None)]):
+            self.assertIsNone(literal_prefix_tokens(r'^!weather\s'))
+        with mock.patch.object(filters, 'sre_parse', None):
+            self.assertIsNone(literal_prefix_tokens(r'^!weather\s'))
+
+
+class FilterIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.chains = compiled({
+            'loose': FilterChain([r'.*(?P<url>https?://\S+)']),
+            'weather': FilterChain([r'^!weather\s+(?P<location>.*)$',
+                                    r'^!weather$']),
+            'greeting': FilterChain([r'^(hi|hello)\b']),
+            'forecast': FilterChain([r'^!(weather|forecast)\b']),
+            'shout': FilterChain([r'(?i)^hey\b']),
+        })
+        self.index = FilterIndex(self.chains)
+
+    def test_candidates_keep_dict_order(self):
+        self.assertEqual(self.index.candidates('!weather seattle'),
+                         ('loose', 'weather', 'forecast', 'shout'))
+        self.assertEqual(self.index.candidates('!forecast'),
+                         ('loose', 'forecast', 'shout'))
+        self.assertEqual(self.index.candidates('hello there'),
+                         ('loose', 'greeting', 'shout'))
+
+    def test_unknown_tokens_only_get_unindexed_chains(self):
+        self.assertEqual(self.index.candidates('!weathers'),
+                         ('loose', 'shout'))
+        self.assertEqual(self.index.candidates(''), ('loose', 'shout'))
+
+    def test_tokens(self):
+        self.assertIsNone(self.index.tokens)
+        del self.chains['loose'], self.chains['shout']
+        self.assertEqual(FilterIndex(self.chains).tokens,
+                         {'!weather', '!forecast', 'hi', 'hello'})
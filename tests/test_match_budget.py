@@ -0,0 +1,71 @@
+import asyncio
+import re
+import unittest
+from unittest import mock
+
+from tenyksservice.executors import MatchResult
+from tenyksservice.filters import FilterChain
+from tenyksservice.match_budget import IsolatedMatcher
+
+# backtracks for far longer than any budget on a long run of a's
+CATASTROPHIC = r'^(a+)+$'
+
+
+class IsolatedMatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.chains = {
+            'slow': FilterChain([CATASTROPHIC]),
+            'hello': FilterChain([r'^(hi|hello) (?P<name>\w+)']),
+            'local': FilterChain([re.compile(r'^!local (?P<arg>\w+)').match]),
+        }
+        for chain in self.chains.values():
+            chain._compile_filters()
+        self.matcher = IsolatedMatcher(self.chains, 0.5, loop=self.loop)
+        self.addCleanup(self.matcher.close)
+
+    def attempt_match(self, message, names=None):
+        return self.loop.run_until_complete(self.matcher.attempt_match(
+            names or tuple(self.chains), message))
+
+    def test_match_comes_back_as_a_match_result(self):
+        self.assertTrue(self.loop.run_until_complete(
+            self.matcher.wait_ready()))
+        name, match = self.attempt_match('hello kyle')
+        self.assertEqual(name, 'hello')
+        self.assertIsInstance(match, MatchResult)
+        self.assertEqual(match.group(), 'hello kyle')
+        self.assertEqual(match.groupdict(), {'name': 'kyle'})
+        self.assertEqual(match.span('name'), (6, 10))
+        self.assertEqual(self.attempt_match('nope'), (None, None))
+
+    def test_precompiled_chains_match_in_this_process(self):
+        name, match = self.attempt_match('!local thing')
+        self.assertEqual(name, 'local')
+        self.assertEqual(match.re.pattern, r'^!local (?P<arg>\w+)')
+
+    def test_timeout_restarts_the_process_and_counts_as_no_match(self):
+        self.assertTrue(self.loop.run_until_complete(
+            self.matcher.wait_ready()))
+        first = self.matcher._process
+        self.assertEqual(self.attempt_match('a' * 40 + 'b'), (None, None))
+        self.assertEqual((self.matcher.timeouts, self.matcher.restarts),
+                         (1, 1))
+        self.assertIsNot(self.matcher._process, first)
+        self.assertFalse(first.is_alive())
+        # the new process picks up where the old one left off
+        name, match = self.attempt_match('hi amy')
+        self.assertEqual((name, match.group('name')), ('hello', 'amy'))
+        self.assertEqual(self.matcher.timeouts, 1)
+
+    def test_matches_without_a_budget_if_the_process_never_starts(self):
+        with mock.patch.object(self.matcher, 'start'), \
+                mock.patch.object(self.matcher, '_recv',
+                                  side_effect=asyncio.TimeoutError):
+            self.assertFalse(self.loop.run_until_complete(
+                self.matcher.wait_ready()))
+        name, match = self.attempt_match('hello kyle')
+        self.assertEqual(name, 'hello')
+        self.assertNotIsInstance(match, MatchResult)
@@ -0,0 +1,138 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from tenyksservice.outbound import OutboundQueue
+
+from tests.common import close_service, make_service, privmsg
+
+
+class GatedStream(object):
+    """
+    A stream whose `drain` waits until the test opens the gate.
+    """
+
+    def __init__(self, fail=0):
+        self.frames = []
+        self.gate = asyncio.Event()
+        self.fail = fail
+
+    def write(self, frames):
+        if self.fail:
+            self.fail -= 1
+            raise OSError('write failed')
+        self.frames.extend(frames)
+
+    async def drain(self):
+        await self.gate.wait()
+
+
+class OutboundQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.logger = mock.Mock()
+        self.queue = OutboundQueue(high_water_mark=3, loop=self.loop,
+                                   logger=self.logger)
+
+        def close():
+            self.queue.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+        self.addCleanup(close)
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    def test_frames_beyond_the_high_water_mark_are_dropped(self):
+        for n in range(5):
+            self.queue.put(n)
+        self.assertEqual((self.queue.depth, self.queue.dropped), (3, 2))
+        self.assertEqual(self.logger.warning.call_count, 1)
+        self.assertFalse(self.queue._room.is_set())
+
+        stream = GatedStream()
+        stream.gate.set()
+        self.queue.start(stream)
+        self.run_until_complete(self.queue.flush())
+        self.assertEqual(stream.frames, [0, 1, 2])
+        self.assertEqual(self.queue.frames_sent, 3)
+
+    def test_waiting_callers_are_held_back_not_dropped(self):
+        stream = GatedStream()
+        self.queue.start(stream)
+
+        async def send(n):
+            await self.queue.wait_for_room()
+            self.queue.put(n)
+
+        async def main():
+            senders = asyncio.gather(*[send(n) for n in range(20)])
+            while not senders.done():
+                await asyncio.sleep(0)
+                # let one batch drain at a time
+                stream.gate.set()
+                stream.gate.clear()
+            await senders
+            stream.gate.set()
+            await self.queue.flush()
+
+        self.run_until_complete(main())
+        self.assertEqual(sorted(stream.frames), list(range(20)))
+        self.assertEqual(self.queue.dropped, 0)
+
+    def test_flush_returns_after_a_write_error(self):
+        stream = GatedStream(fail=1)
+        stream.gate.set()
+        self.queue.start(stream)
+        self.queue.put('lost')
+        self.queue.put('lost too')
+        self.run_until_complete(self.queue.flush())
+        self.assertEqual(self.queue.dropped, 2)
+        self.assertEqual(self.logger.exception.call_count, 1)
+
+        # the writer is still going
+        self.queue.put('sent')
+        self.run_until_complete(self.queue.flush())
+        self.assertEqual(stream.frames, ['sent'])
+
+    def test_close_releases_waiters(self):
+        self.queue.start(GatedStream())
+
+        async def main():
+            # the writer takes the first batch and gets stuck draining it
+            for n in range(6):
+                self.queue.put(n)
+                await asyncio.sleep(0)
+            self.assertEqual(self.queue.depth, 3)
+            waiter = asyncio.ensure_future(self.queue.wait_for_room())
+            await asyncio.sleep(0)
+            self.assertFalse(waiter.done())
+            self.queue.close()
+            await waiter
+
+        self.run_until_complete(main())
+
+
+class SendAsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_many_send_async_callers_lose_nothing(self):
+        service = make_service(self.loop, OUTBOUND_HIGH_WATER_MARK=2)
+        self.addCleanup(close_service, service)
+        data = privmsg('!many')
+
+        async def main():
+            await asyncio.gather(*[service.send_async(str(n), data)
+                                   for n in range(50)])
+            await service.outbound.flush()
+
+        self.loop.run_until_complete(asyncio.wait_for(main(), 5))
+        self.assertEqual(sorted(int(f['payload'])
+                                for f in service.stream.frames),
+                         list(range(50)))
+        self.assertEqual(service.outbound.dropped, 0)
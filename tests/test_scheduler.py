@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import time
+import unittest
+
+from tenyksservice.executors import THREAD, make_executor, offload
+from tenyksservice.metrics import Registry
+from tenyksservice.scheduler import (Cron, Every, JobSpec, Scheduler, cron,
+                                     every)
+
+
+class FakeLoop:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class CronTestCase(unittest.TestCase):
+
+    def assertNextTime(self, spec, after, expected):
+        self.assertEqual(Cron(spec).next_time(datetime.datetime(*after)),
+                         datetime.datetime(*expected))
+
+    def test_steps_ranges_and_weekdays(self):
+        spec = '*/15 9-17 * * 1-5'
+        # a Saturday, so the next run is Monday morning
+        self.assertNextTime(spec, (2026, 10, 17, 12, 0),
+                            (2026, 10, 19, 9, 0))
+        self.assertNextTime(spec, (2026, 10, 19, 9, 14, 30),
+                            (2026, 10, 19, 9, 15))
+        self.assertNextTime(spec, (2026, 10, 19, 9, 15),
+                            (2026, 10, 19, 9, 30))
+        self.assertNextTime(spec, (2026, 10, 23, 17, 45),
+                            (2026, 10, 26, 9, 0))
+
+    def test_lists_and_month_rollover(self):
+        self.assertNextTime('0 12 1,15 * *', (2026, 12, 15, 12, 0),
+                            (2027, 1, 1, 12, 0))
+
+    def test_leap_day(self):
+        self.assertNextTime('0 0 29 2 *', (2026, 1, 1),
+                            (2028, 2, 29, 0, 0))
+
+    def test_either_day_field_when_both_are_restricted(self):
+        # the 13th or any Friday
+        self.assertNextTime('0 0 13 * 5', (2026, 10, 18),
+                            (2026, 10, 23, 0, 0))
+        self.assertNextTime('0 0 13 * 5', (2026, 11, 12, 1, 0),
+                            (2026, 11, 13, 0, 0))
+
+    def test_a_stepped_star_is_not_a_restriction(self):
+        # every other day that is a Monday, not every other day or Monday
+        spec = '0 0 */2 * 1'
+        self.assertNextTime(spec, (2026, 10, 18), (2026, 10, 19, 0, 0))
+        self.assertNextTime(spec, (2026, 10, 19, 1, 0), (2026, 11, 9, 0, 0))
+
+    def test_sunday_is_0_or_7(self):
+        self.assertEqual(Cron('0 0 * * 7').weekdays, {0, 7})
+        self.assertNextTime('0 0 * * 7', (2026, 10, 14),
+                            (2026, 10, 18, 0, 0))
+
+    def test_bad_specs(self):
+        for spec in ['* * * *', '60 * * * *', '* 24 * * *', '* * 0 * *',
+                     '* * * 13 *', '* * * * 8', '*/0 * * * *', '5-1 * * * *',
+                     'x * * * *']:
+            with self.assertRaises(ValueError, msg=spec):
+                Cron(spec)
+
+    def test_never_fires(self):
+        with self.assertRaises(ValueError):
+            Cron('0 0 31 2 *').next_time(datetime.datetime(2026, 1, 1))
+
+
+class EveryTestCase(unittest.TestCase):
+
+    def test_due_times_keep_to_the_interval(self):
+        loop = FakeLoop()
+        schedule = Every(10)
+        self.assertEqual(schedule.next_delay(loop), 0)
+        loop.now = 2
+        self.assertEqual(schedule.next_delay(loop), 8)
+        loop.now = 10.5
+        self.assertEqual(schedule.next_delay(loop), 9.5)
+
+    def test_missed_runs_are_skipped(self):
+        loop = FakeLoop()
+        schedule = Every(10, run_at_start=False)
+        self.assertEqual(schedule.next_delay(loop), 10)
+        loop.now = 45
+        self.assertEqual(schedule.next_delay(loop), 10)
+
+    def test_interval_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            Every(0)
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_instances_get_their_own_schedules(self):
+        class Service:
+            @every(10)
+            def poll(self):
+                pass
+
+            @cron('0 * * * *')
+            def hourly(self):
+                pass
+
+        first = Scheduler(loop=self.loop)
+        first.add_jobs_from(Service())
+        second = Scheduler(loop=self.loop)
+        second.add_jobs_from(Service())
+        self.assertEqual(sorted(first.jobs), ['hourly', 'poll'])
+        for name in first.jobs:
+            self.assertIsNot(first.jobs[name].schedule,
+                             second.jobs[name].schedule)
+            self.assertIsNot(first.jobs[name].schedule,
+                             Service.__dict__[name]._job.schedule)
+
+        fake = FakeLoop()
+        first.jobs['poll'].schedule.next_delay(fake)
+        # the second service's first run isn't pushed back by the first's
+        self.assertEqual(second.jobs['poll'].schedule.next_delay(fake), 0)
+
+    def test_runs_are_counted_by_outcome(self):
+        async def slow():
+            await asyncio.sleep(1)
+
+        def broken():
+            raise ValueError()
+
+        @offload(THREAD)
+        def blocking():
+            time.sleep(0.05)
+
+        executor = make_executor(THREAD, 1)
+        self.addCleanup(executor.shutdown)
+        metrics = Registry()
+        scheduler = Scheduler(loop=self.loop, metrics=metrics,
+                              get_executor=lambda kind: executor)
+        for name, func in [('ok', lambda: None), ('slow', slow),
+                           ('broken', broken), ('blocking', blocking)]:
+            scheduler.add(name, func, JobSpec(Every(60), timeout=0.01))
+        for job in scheduler.jobs.values():
+            self.loop.run_until_complete(scheduler._run(job))
+
+        jobs = scheduler.jobs
+        self.assertEqual((jobs['slow'].timeouts, jobs['blocking'].timeouts),
+                         (1, 1))
+        self.assertEqual(jobs['broken'].failures, 1)
+        self.assertEqual(sum(job.runs for job in jobs.values()), 4)
+        self.assertEqual(scheduler._metric_runs.snapshot(), {
+            ('ok', 'ok'): 1, ('slow', 'timeout'): 1,
+            ('broken', 'error'): 1, ('blocking', 'timeout'): 1})
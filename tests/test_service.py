@@ -0,0 +1,89 @@
+import asyncio
+import json
+import unittest
+
+from tenyksservice import FilterChain, memoize
+
+from tests.common import close_service, make_service, privmsg
+
+
+class HandlerTimeoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_timeout_cancels_memoized_handlers(self):
+        cancelled = []
+
+        @memoize()
+        async def handle_mslow(self, data, match):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(data['nick'])
+                raise
+            self.send('too late', data)
+
+        service = make_service(self.loop, {
+            'irc_message_filters': {'mslow': FilterChain([r'^!mslow$'])},
+            'handle_mslow': handle_mslow,
+        }, HANDLER_TIMEOUT=0.05)
+        self.addCleanup(close_service, service)
+
+        async def main():
+            await asyncio.gather(service._delegate(privmsg('!mslow')),
+                                 service._delegate(privmsg('!mslow',
+                                                           nick='amy')))
+            await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(main())
+        # both callers shared the one call, which went when they both did
+        self.assertEqual(cancelled, ['kyle'])
+        self.assertEqual(service.stream.frames, [])
+        self.assertEqual(service._metric_handler_timeouts.snapshot(),
+                         {('handle_mslow', 'cancelled'): 2})
+        self.assertEqual(handle_mslow.cache_info().currsize, 0)
+
+
+class ControlCommandTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_ping_is_answered_while_handlers_hold_every_slot(self):
+        released = asyncio.Event()
+
+        async def handle_slow(self, data, match):
+            await released.wait()
+            self.send('done', data)
+
+        service = make_service(self.loop, {
+            'irc_message_filters': {'slow': FilterChain([r'^!slow$'])},
+            'handle_slow': handle_slow,
+        }, DISPATCH_CONCURRENCY=2)
+        self.addCleanup(close_service, service)
+
+        def frame(data):
+            return json.dumps(data).encode('utf-8')
+
+        async def main():
+            for nick in ('kyle', 'amy', 'søren'):
+                await service._receive(frame(privmsg('!slow', nick=nick)))
+            for _ in range(3):
+                await asyncio.sleep(0)
+            self.assertEqual(service.dispatcher.in_flight, 2)
+            await service._receive(frame({'command': 'PING', 'payload': '',
+                                          'target': '', 'connection': ''}))
+            await service.outbound.flush()
+            commands = [f['command'] for f in service.stream.frames]
+            released.set()
+            while service.dispatcher.conversations:
+                await asyncio.sleep(0)
+            await service.outbound.flush()
+            return commands
+
+        self.assertEqual(self.loop.run_until_complete(main()), ['PONG'])
+        self.assertEqual([f['payload'] for f in service.stream.frames],
+                         ['', 'done', 'done', 'done'])
@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from tenyksservice.singleflight import SingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.flight = SingleFlight()
+        self.calls = []
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    async def fetch(self, value, fail=False):
+        self.calls.append(value)
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError(value)
+        return value
+
+    def test_concurrent_calls_share_one_result(self):
+        async def main():
+            return await asyncio.gather(
+                *[self.flight.do('k', self.fetch, n) for n in range(4)],
+                self.flight.do('other', self.fetch, 'other'))
+
+        self.assertEqual(self.run_until_complete(main()),
+                         [0, 0, 0, 0, 'other'])
+        self.assertEqual(self.calls, [0, 'other'])
+        self.assertEqual((self.flight.calls, self.flight.shared), (2, 3))
+        self.assertEqual(len(self.flight), 0)
+
+    def test_concurrent_calls_share_one_exception(self):
+        async def main():
+            return await asyncio.gather(
+                *[self.flight.do('k', self.fetch, 'x', fail=True)
+                  for _ in range(3)], return_exceptions=True)
+
+        errors = self.run_until_complete(main())
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertIs(errors[0], errors[2])
+
+    def test_nothing_is_kept_after_a_call(self):
+        async def main():
+            with self.assertRaises(ValueError):
+                await self.flight.do('k', self.fetch, 1, fail=True)
+            return await self.flight.do('k', self.fetch, 2)
+
+        self.assertEqual(self.run_until_complete(main()), 2)
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.flight.shared, 0)
+
+    def test_a_cancelled_caller_does_not_cancel_the_call(self):
+        async def main():
+            first = asyncio.ensure_future(self.flight.do('k', self.fetch, 1))
+            second = asyncio.ensure_future(self.flight.do('k', self.fetch, 2))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(self.run_until_complete(main()), 1)
+        self.assertEqual(self.calls, [1])
+
+    def test_plain_functions_are_not_coalesced(self):
+        async def main():
+            return await self.flight.do('k', lambda: 'plain')
+
+        self.assertEqual(self.run_until_complete(main()), 'plain')
+        self.assertEqual(self.flight.calls, 0)
+
+    def test_the_call_is_cancelled_with_its_last_caller(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def main():
+            callers = [asyncio.ensure_future(self.flight.do('k', slow))
+                       for _ in range(2)]
+            await asyncio.sleep(0)
+            callers[0].cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(cancelled, [])
+            callers[1].cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        self.run_until_complete(main())
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(len(self.flight), 0)
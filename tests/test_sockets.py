@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import aiozmq
+import zmq
+
+from tenyksservice.sockets import (close_publisher, connect_publisher,
+                                   connect_subscriber, wait_until_connected)
+
+
+class WaitUntilConnectedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.logger = mock.Mock()
+
+    def connect(self, in_addr, out_addr, timeout):
+        async def main():
+            subscriber = await connect_subscriber(in_addr, loop=self.loop)
+            publisher, subscribed = await connect_publisher(out_addr,
+                                                            loop=self.loop)
+            try:
+                return await wait_until_connected(subscriber, subscribed,
+                                                  timeout, logger=self.logger)
+            finally:
+                subscriber.close()
+                close_publisher(publisher, 0)
+                await asyncio.sleep(0)
+        return self.loop.run_until_complete(main())
+
+    def test_connected_once_the_hub_is_there(self):
+        async def bind():
+            pub = await aiozmq.create_zmq_stream(
+                zmq.PUB, bind='tcp://127.0.0.1:*', loop=self.loop)
+            sub = await aiozmq.create_zmq_stream(
+                zmq.SUB, bind='tcp://127.0.0.1:*', loop=self.loop)
+            sub.transport.setsockopt(zmq.SUBSCRIBE, b'')
+            return pub, sub
+
+        pub, sub = self.loop.run_until_complete(bind())
+
+        def close():
+            pub.close()
+            sub.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+        self.addCleanup(close)
+        self.assertTrue(self.connect(list(pub.transport.bindings())[0],
+                                     list(sub.transport.bindings())[0], 5))
+        self.logger.warning.assert_not_called()
+
+    def test_warns_and_carries_on_without_the_hub(self):
+        self.assertFalse(self.connect('tcp://127.0.0.1:1', 'tcp://127.0.0.1:1',
+                                      0.1))
+        self.logger.warning.assert_called_once_with(
+            'tenyks did not answer within 0.1s, carrying on and registering '
+            'when it does')
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tenyksservice import sqlite_context
+from tenyksservice.context import ExpirableContext
+from tenyksservice.sqlite_context import SharedContext, SqliteContextStore
+
+
+class SqliteContextStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='tenyks-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'contexts.sqlite3')
+        # two processes sharing the database, without a cache in between
+        self.first = self.store()
+        self.second = self.store()
+
+    def store(self):
+        store = SqliteContextStore(self.path, cache_ttl=0)
+        self.addCleanup(store.close)
+        return store
+
+    def lock(self):
+        """
+        Holds the write lock the way another process in the middle of a
+        write would, until the returned connection commits.
+        """
+        blocker = sqlite3.connect(self.path, isolation_level=None,
+                                  check_same_thread=False)
+        blocker.execute('BEGIN IMMEDIATE')
+        self.addCleanup(blocker.close)
+        return blocker
+
+    def test_writes_are_shared(self):
+        self.first['a'] = {'step': 1}
+        self.assertEqual(self.second['a'], {'step': 1})
+        ctx = self.first.expirable_context({'nick': 'kyle'}, 60)
+        self.first['b'] = ctx
+        ctx['step'] = 2
+        shared = self.second['b']
+        self.assertIsInstance(shared, SharedContext)
+        self.assertEqual((shared['step'], shared.msg), (2, {'nick': 'kyle'}))
+        del self.second['b']
+        self.assertIsNone(self.first.get('b'))
+        self.assertEqual(sorted(self.first), ['a'])
+
+    def test_expired_contexts_are_not_returned_or_kept(self):
+        evicted = []
+        self.second.add_eviction_callback(
+            lambda key, ctx, reason: evicted.append((key, reason)))
+        self.first['a'] = self.first.expirable_context({}, 10)
+        self.assertIn('a', self.second)
+        real_time = time.time
+        with mock.patch.object(sqlite_context.time, 'time',
+                               lambda: real_time() + 11):
+            self.assertNotIn('a', self.second)
+            self.assertEqual(len(self.second), 0)
+            self.second.purge_interval = 0
+            self.second['b'] = {}
+        self.assertEqual(evicted, [('a', 'ttl')])
+
+    def test_process_bound_contexts_are_refused(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        ctx = ExpirableContext({}, loop=loop, timeout=10)
+        self.addCleanup(ctx.cancel)
+        with self.assertRaises(TypeError):
+            self.first['a'] = ctx
+        with self.assertRaisesRegex(TypeError, 'picklable'):
+            self.first['b'] = {'callback': lambda: None}
+        self.assertEqual(len(self.first), 0)
+
+    def test_locked_writes_are_kept_and_retried(self):
+        blocker = self.lock()
+        start = time.monotonic()
+        self.first['a'] = {'step': 1}
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual((self.first.contended, self.first.stats()['pending']),
+                         (1, 1))
+        # this process sees its own write, the others don't yet
+        self.assertEqual(self.first['a'], {'step': 1})
+        self.assertIsNone(self.second.get('a'))
+        blocker.commit()
+
+        with mock.patch.object(sqlite_context, 'retry_interval', 0):
+            self.first._retry_at = 0
+            self.first.get('a')
+        self.assertEqual(self.first.stats()['pending'], 0)
+        self.assertEqual(self.second['a'], {'step': 1})
+
+    def test_a_delete_that_is_locked_out_still_hides_the_context(self):
+        self.first['a'] = {'step': 1}
+        blocker = self.lock()
+        self.first.pop('a')
+        self.assertIsNone(self.first.get('a'))
+        self.assertEqual(self.first.stats()['pending'], 1)
+        blocker.commit()
+
+    def test_close_waits_to_write_what_is_pending(self):
+        blocker = self.lock()
+        self.first['a'] = {'step': 1}
+        self.first['a'] = {'step': 2}
+        self.assertEqual(self.first.stats()['pending'], 1)
+        release = threading.Timer(0.2, blocker.commit)
+        release.start()
+        self.addCleanup(release.cancel)
+        self.first.close()
+        self.assertEqual(self.second['a'], {'step': 2})
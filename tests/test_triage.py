@@ -0,0 +1,62 @@
+import json
+import unittest
+
+from tenyksservice.triage import Triage
+
+
+def frame(command, payload=None, **fields):
+    data = dict(fields, command=command)
+    if payload is not None:
+        data['payload'] = payload
+    return json.dumps(data).encode('utf-8')
+
+
+class TriageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.triage = Triage()
+        self.triage.configure(['privmsg', 'PING'], ['!weather', 'hi'])
+
+    def test_keeps_everything_until_configured(self):
+        triage = Triage()
+        self.assertTrue(triage.accepts(frame('JOIN')))
+        self.assertEqual(triage.dropped, 0)
+
+    def test_drops_commands_without_a_handler(self):
+        self.assertFalse(self.triage.accepts(frame('JOIN')))
+        self.assertTrue(self.triage.accepts(frame('ping')))
+        self.assertEqual(self.triage.dropped, 1)
+
+    def test_drops_privmsgs_nothing_listens_for(self):
+        self.assertTrue(self.triage.accepts(
+            frame('PRIVMSG', '!weather seattle', nick='kyle')))
+        self.assertTrue(self.triage.accepts(frame('PRIVMSG', "hi, I'm kyle")))
+        self.assertFalse(self.triage.accepts(frame('PRIVMSG', '!weath')))
+        self.assertFalse(self.triage.accepts(frame('PRIVMSG', 'hello')))
+        self.assertEqual(self.triage.dropped, 2)
+
+    def test_every_privmsg_without_tokens(self):
+        self.triage.configure(['PRIVMSG'])
+        self.assertTrue(self.triage.accepts(frame('PRIVMSG', 'anything')))
+        self.assertFalse(self.triage.accepts(frame('PING')))
+
+    def test_keeps_frames_it_cannot_judge(self):
+        unjudged = [
+            b'{"payload": "hello"}',
+            b'not json at all',
+            # an escape inside or right after the first token
+            b'{"command": "PRIVMSG", "payload": "h\\u0069"}',
+            b'{"command": "PRIVMSG", "payload": "!weathe\\u0072"}',
+            # a first token running past the window
+            frame('PRIVMSG', 'x' * 200),
+            # a payload cut off inside a multibyte character
+            ('{"command": "PRIVMSG", "payload": "a%s"}' % ('é' * 100)).encode(
+                'utf-8'),
+        ]
+        for data in unjudged:
+            self.assertTrue(self.triage.accepts(data), data)
+        self.assertEqual(self.triage.dropped, 0)
+
+    def test_payload_before_command(self):
+        data = b'{"payload": "hello", "command": "PRIVMSG"}'
+        self.assertFalse(self.triage.accepts(data))
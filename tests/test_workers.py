@@ -0,0 +1,60 @@
+import json
+import unittest
+from unittest import mock
+
+from tenyksservice.codec import get_codec
+from tenyksservice.workers import shard_for, shard_for_frame
+
+MESSAGES = [
+    {'command': 'PRIVMSG', 'connection': 'freenode', 'target': '#tenyks',
+     'nick': 'kyle', 'payload': "hi, I'm kyle"},
+    {'command': 'PRIVMSG', 'connection': 'freenode', 'target': '#tenyks',
+     'nick': 'amy', 'payload': '"nick": "kyle", "target": "elsewhere"'},
+    {'command': 'PRIVMSG', 'connection': 'freenode', 'target': 'tenyks',
+     'nick': 'søren', 'payload': '!weather Zürich'},
+    {'command': 'PRIVMSG', 'connection': 'freenode', 'target': '#tenyks',
+     'nick': 'a"quoted\\nick', 'payload': 'hi'},
+    {'command': 'PING', 'payload': ''},
+    {'command': 'HELLO', 'payload': '', 'target': '', 'connection': ''},
+]
+
+
+class ShardTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = get_codec('json')
+
+    def frames(self, data):
+        yield json.dumps(data).encode('utf-8')
+        yield json.dumps(data, ensure_ascii=False).encode('utf-8')
+        yield json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def test_raw_frames_shard_like_decoded_messages(self):
+        for workers in (2, 3, 8):
+            for data in MESSAGES:
+                for frame in self.frames(data):
+                    self.assertEqual(
+                        shard_for_frame(frame, workers, self.codec),
+                        shard_for(data, workers), frame)
+
+    def test_plain_frames_are_not_decoded(self):
+        codec = mock.Mock(wraps=self.codec)
+        for frame in self.frames(MESSAGES[0]):
+            shard_for_frame(frame, 4, codec)
+        shard_for_frame(json.dumps(MESSAGES[4]).encode('utf-8'), 4, codec)
+        self.assertEqual(codec.decode.call_count, 0)
+
+    def test_escaped_keys_are_decoded(self):
+        codec = mock.Mock(wraps=self.codec)
+        shard_for_frame(json.dumps(MESSAGES[3]).encode('utf-8'), 4, codec)
+        shard_for_frame(json.dumps(MESSAGES[2]).encode('utf-8'), 4, codec)
+        self.assertEqual(codec.decode.call_count, 2)
+
+    def test_a_conversation_stays_on_one_worker(self):
+        data = dict(MESSAGES[0])
+        shards = set()
+        for payload in ('one', 'two', '"three"', 'fünf'):
+            data['payload'] = payload
+            for frame in self.frames(data):
+                shards.add(shard_for_frame(frame, 8, self.codec))
+        self.assertEqual(len(shards), 1)